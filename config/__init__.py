@@ -1,15 +1,45 @@
 # __init__.py
+#
+# The configuration is read on first access of config_dict or nrt_token
+# (module __getattr__), not at import. base_dir and path are plain paths
+# set at import, no files are read for them. Spawned worker processes
+# use the configuration of the parent, passed to install.
 
 import pathlib
-import tomllib
-import dotenv
+import functools
 
 base_dir = pathlib.Path(__file__).parent.parent
-nrt_token = dotenv.dotenv_values()['nrt_token']
-
 path = pathlib.Path(__file__).parent / "configuration.toml"
-with path.open(mode="rb") as fp:
-    config_dict = tomllib.load(fp)
 
-config_dict["nrt_token"] = nrt_token
-config_dict["base_dir"] = base_dir
+
+# configuration dict passed by install, used instead of the file
+_installed = None
+
+
+def install(config_dict: dict):
+    """Use config_dict as the configuration, e.g. in a worker process
+    (pool initializer) the configuration of the parent, including the
+    changes made to it at runtime"""
+    global _installed
+    _installed = config_dict
+
+
+@functools.lru_cache(maxsize=None)
+def load() -> dict:
+    """Read configuration.toml and the nrt token from .env, once"""
+    import tomllib
+    import dotenv
+
+    with path.open(mode="rb") as fp:
+        config_dict = tomllib.load(fp)
+    config_dict["nrt_token"] = dotenv.dotenv_values()["nrt_token"]
+    config_dict["base_dir"] = base_dir
+    return config_dict
+
+
+def __getattr__(name):
+    if name == "config_dict":
+        return _installed if _installed is not None else load()
+    if name == "nrt_token":
+        return __getattr__("config_dict")["nrt_token"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
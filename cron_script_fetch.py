@@ -1,7 +1,7 @@
-from firedata import populate_db
+import sys
 
-pc = populate_db.ProcSQL("VIIRS_NPP")
-nrt = pc.get_nrt()
-nrt = pc.prepare_detections_dataset(nrt)
-assert nrt.date.is_monotonic_increasing, "The date column is not ordered"
-pc.dataframe_to_db(nrt)
+from activefire.firedata import orchestrate
+
+if __name__ == "__main__":
+    # fetch, transform and load all TASKS nrt_sensors concurrently
+    sys.exit(orchestrate.run_all())
@@ -133,6 +133,66 @@ sql_datatypes = {
 }
 
 
+# Memory optimised dtypes (DATABASE compact_dtypes). Detections with
+# the smallest integer types the value ranges allow, raw FIRMS datasets
+# with categorical string columns.
+compact_dtypes = {
+    "SQL_detections_dtypes": {
+        "id": "int64",
+        "latitude": "float32",
+        "longitude": "float32",
+        "frp": "float32",
+        "daynight": "int8",
+        "type": "int8",
+        "date": "uint32",
+        "lc": "uint8",
+        "admin": "int16",
+        "event": "int64",
+    },
+    "FIRMS_dtypes": {
+        "latitude": "float32",
+        "longitude": "float32",
+        "brightness": "float32",
+        "bright_ti4": "float32",
+        "bright_ti5": "float32",
+        "bright_t31": "float32",
+        "scan": "float32",
+        "track": "float32",
+        "acq_time": "int16",
+        "satellite": "category",
+        "instrument": "category",
+        "confidence": "category",
+        "version": "category",
+        "frp": "float32",
+        "daynight": "category",
+        "type": "int8",
+    },
+}
+
+
+def bytes_per_detection(dfr: pd.DataFrame) -> float:
+    """Memory used by the DataFrame per row (detection)"""
+    if len(dfr) == 0:
+        return 0.0
+    return dfr.memory_usage(deep=True).sum() / len(dfr)
+
+
+def detection_keys(longitude, latitude, dates) -> np.ndarray:
+    """
+    64 bit integer keys identifying fire detections. Acquisition time
+    (unix time, minutes since 2000-01-01) is stored in the high 26 bits
+    and latitude and longitude quantised to 0.001 deg in the low 18
+    and 19 bits. Keys of a time window form a contiguous range.
+    Coordinates are rounded as stored in the database (float32).
+    """
+    minutes = (np.asarray(dates, dtype=np.int64) - 946684800) // 60
+    lat = np.asarray(latitude, dtype=np.float32).astype(np.float64)
+    lon = np.asarray(longitude, dtype=np.float32).astype(np.float64)
+    lat_q = np.rint((lat + 90) * 1000).astype(np.int64)
+    lon_q = np.rint((lon + 180) * 1000).astype(np.int64)
+    return (minutes << 37) | (lat_q << 19) | lon_q
+
+
 def get_project_root() -> Path:
     return Path(__file__).parent.parent
 
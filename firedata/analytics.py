@@ -0,0 +1,147 @@
+"""
+Analytics (reporting) queries run through DuckDB, an embedded
+vectorized columnar engine, over the fire database. The sqlite
+database is attached read-only, and year partitions and the parquet
+store are exposed as views, so the same SQL used against sqlite
+runs unchanged without competing with the loader.
+
+The DuckDB sqlite extension is installed at deploy time with
+
+    python -m activefire.firedata.analytics
+
+and only loaded at query time. Without it queries run on the main
+sqlite database file directly. This is refused (AnalyticsUnavailable)
+when extinct detections are stored in year partitions or the parquet
+store, the results would miss them.
+"""
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class AnalyticsUnavailable(RuntimeError):
+    """The DuckDB sqlite extension is missing and the storage in use
+    can not be queried without it"""
+
+
+def install_extension():
+    """Download and install the DuckDB sqlite extension"""
+    import duckdb
+
+    conn = duckdb.connect()
+    conn.execute("INSTALL sqlite")
+    conn.close()
+
+
+def sql_string_literal(value) -> str:
+    """value as a quoted SQL string literal"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class AnalyticsEngine(object):
+    """DuckDB connection with views of the tables of DataBase db"""
+
+    tables = ["events", "detections_active", "detections_extinct"]
+
+    def __init__(self, db):
+        self.db = db
+        self._conn = None
+        # partition years of the detections_extinct view, see update_extinct_view
+        self._extinct_view = False
+        self._years = None
+        # False once loading the sqlite extension failed
+        self.available = True
+
+    def connection(self):
+        """Return DuckDB connection, set it up on first use, None if
+        the sqlite extension is not installed"""
+        if self._conn is None and self.available:
+            import duckdb
+
+            conn = duckdb.connect()
+            try:
+                conn.execute("LOAD sqlite")
+            except duckdb.Error as exc:
+                logger.warning("DuckDB sqlite extension not available: %s", exc)
+                conn.close()
+                self.available = False
+                return None
+            db_file = sql_string_literal(self.db.db_file)
+            conn.execute(f"ATTACH {db_file} AS fire (TYPE sqlite, READ_ONLY)")
+            for table in ["events", "detections_active"]:
+                conn.execute(f"CREATE VIEW {table} AS SELECT * FROM fire.{table}")
+            self._conn = conn
+        if self._conn is not None:
+            self.update_extinct_view()
+        return self._conn
+
+    def update_extinct_view(self):
+        """(Re)create the detections_extinct view when the set of year
+        partitions has changed since it was created"""
+        years = None
+        if self.db.store is None and self.db.partitioned:
+            years = tuple(self.db.partition_years())
+        if self._extinct_view and years == self._years:
+            return
+        self._conn.execute(
+            f"CREATE OR REPLACE VIEW detections_extinct AS {self.extinct_source(years)}"
+        )
+        self._extinct_view = True
+        self._years = years
+
+    def extinct_source(self, years: tuple = None) -> str:
+        """SQL selecting extinct detections from the storage in use"""
+        if self.db.store is not None:
+            path = Path(self.db.store.table_path("detections"), "**", "*.parquet")
+            return f"""SELECT * EXCLUDE (sensor, year, month)
+                FROM read_parquet({sql_string_literal(path)}, hive_partitioning = true)
+                WHERE sensor = {sql_string_literal(self.db.store.sensor)}"""
+        if years:
+            attached = set(
+                self._conn.execute("SELECT database_name FROM duckdb_databases()")
+                .df()
+                .database_name
+            )
+            selects = []
+            for year in years:
+                if f"p{year}" not in attached:
+                    part_file = sql_string_literal(self.db.partition(year).db_file)
+                    self._conn.execute(
+                        f"ATTACH {part_file} AS p{year} (TYPE sqlite, READ_ONLY)"
+                    )
+                selects.append(f"SELECT * FROM p{year}.detections_extinct")
+            return " UNION ALL ".join(selects)
+        return "SELECT * FROM fire.detections_extinct"
+
+    def query(self, sql_string: str, params=None, arrow: bool = False):
+        """Run sql_string, return pandas DataFrame or pyarrow Table"""
+        conn = self.connection()
+        if conn is None:
+            if self.db.store is not None or self.db.partitioned:
+                raise AnalyticsUnavailable(
+                    "DuckDB sqlite extension not available (install it with "
+                    "python -m activefire.firedata.analytics), extinct detections "
+                    "in year partitions or the parquet store can not be queried"
+                )
+            dfr = self.db.return_many_values(sql_string, params)
+            if arrow:
+                import pyarrow as pa
+
+                return pa.Table.from_pandas(dfr, preserve_index=False)
+            return dfr
+        result = conn.execute(sql_string, params or [])
+        if arrow:
+            return result.arrow()
+        return result.df()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self._extinct_view = False
+
+
+if __name__ == "__main__":
+    install_extension()
+    print("DuckDB sqlite extension installed")
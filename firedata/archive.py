@@ -7,8 +7,14 @@ author: tadas.nik@gmail.com
 
 import os
 import glob
+import argparse
+import multiprocessing
+import concurrent.futures
+from pathlib import Path
+
 import pandas as pd
-from _utils import dataset_dtypes, FireDate
+from activefire import config
+from activefire.firedata._utils import dataset_dtypes, sql_datatypes, FireDate
 
 
 def parse_modis(fname, index_increment, MCD14DL_dtypes):
@@ -50,10 +56,10 @@ def prepare_viirs_snpp(data_path):
         dfr.to_parquet(os.path.join(data_path,
             f'fire_archive_SV-C2_{year}.parquet'))
 
-def prepare_modis_archive_all_years():
+def prepare_modis_archive_all_years(years):
     """ Pre-processing of MODIS archive active fire dataset.
-    Reads yearly csv files and writes parquet. TODO change 
-    process per file rather than per year."""
+    Reads yearly csv files and writes parquet. See convert_archive
+    for processing per file."""
     index_increment = 0
     for year in years:
         fname = f'data/fire_archive_M6_{year}.csv'
@@ -78,14 +84,91 @@ def prepare_modis_nrt(nrt_fname, last_archive_fname, MCD14DL_nrt_dtypes):
     nrt.index = nrt.index + index_increment
     nrt.to_parquet('data/nrt_complete.parquet')
 
+def archive_columns(columns):
+    """Columns of the FIRMS archive csv (columns) read for the archive
+    parquet dataset: the detections table (SQL_detections_dtypes)
+    columns and acq_date, acq_time for FireDate.fire_dates"""
+    needed = list(sql_datatypes["SQL_detections_dtypes"]) + ["acq_date", "acq_time"]
+    return [x for x in columns if x in needed]
+
+
+def convert_file(sensor, fname, out_path):
+    """Convert FIRMS archive csv file fname to the year partitioned
+    parquet dataset at out_path, with the columns and dtypes of the
+    detections table (unix time date, integer daynight). Returns the
+    number of rows written."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    usecols = archive_columns(pd.read_csv(fname, nrows=0).columns)
+    dfr = pd.read_csv(
+        fname,
+        usecols=usecols,
+        dtype={"acq_date": str, "acq_time": str, "daynight": "category"},
+    )
+    dfr["date"] = FireDate.unix_time(FireDate.fire_dates(dfr))
+    dfr["daynight"] = dfr["daynight"].map({"D": 1, "N": 0})
+    dtypes = sql_datatypes["SQL_detections_dtypes"]
+    columns = [x for x in dtypes if x in dfr]
+    dfr = dfr[columns].astype({x: dtypes[x] for x in columns})
+    dfr = dfr.sort_values(by="date").reset_index(drop=True)
+    dfr["sensor"] = sensor
+    dfr["year"] = pd.to_datetime(dfr.date, unit="s").dt.year.values
+    cfg = config.config_dict["DATABASE"]
+    file_options = ds.ParquetFileFormat().make_write_options(
+        compression=cfg["parquet_compression"], write_statistics=True
+    )
+    ds.write_dataset(
+        pa.Table.from_pandas(dfr, preserve_index=False),
+        out_path,
+        format="parquet",
+        partitioning=["sensor", "year"],
+        partitioning_flavor="hive",
+        basename_template=f"{Path(fname).stem}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        file_options=file_options,
+        max_rows_per_group=cfg["parquet_row_group_size"],
+        use_threads=False,
+    )
+    print(f"converted {fname} {len(dfr)} rows")
+    return len(dfr)
+
+
+def convert_archive(sensor, data_path, out_path=None, pattern="fire_archive*.csv", workers=0):
+    """Convert the FIRMS archive csv files of the sensor in data_path to
+    a date sorted, year partitioned (sensor=/year=) parquet dataset at
+    out_path (CLUSTER archive_parquet_path by default), the files are
+    converted in parallel by workers processes (0 for all cores).
+    Returns the total number of rows written."""
+    if out_path is None:
+        out_path = os.path.join(
+            config.config_dict["OS"]["data_path"],
+            config.config_dict["CLUSTER"]["archive_parquet_path"],
+        )
+    fnames = sorted(glob.glob(os.path.join(data_path, pattern)))
+    if len(fnames) == 0:
+        raise FileNotFoundError(f"No {pattern} files in {data_path}")
+    mp_context = multiprocessing.get_context("spawn")
+    pool = concurrent.futures.ProcessPoolExecutor(
+        workers or None,
+        mp_context,
+        initializer=config.install,
+        initargs=(config.config_dict,),
+    )
+    with pool:
+        futures = [pool.submit(convert_file, sensor, x, out_path) for x in fnames]
+        return sum(x.result() for x in futures)
+
+
 if __name__ == "__main__":
-# prepare_modis_archive_all_years()
-# prepare_viirs_snpp('data/VIIRS_NPP')
-# prepare_viirs_noaa('data/VIIRS_NOAA', 2022)
-
-# prepare_modis_archive_all_years([2021])
-# TODO run the bellow setting dtypes when reading csv
-# nrt_fname = '/home/tadas/activefire/firedata/data/fire_nrt_M-C61_238232.csv'
-# last_archive_fname = '/home/tadas/activefire/firedata/data/modis_archive_2021.parquet'
-# prepare_modis_nrt(nrt_fname, last_archive_fname, MCD14DL_nrt_dtypes)
-# prepare_viirs_snpp('data/VIIRS')
+    parser = argparse.ArgumentParser(
+        description="Convert FIRMS archive csv files to year partitioned parquet"
+    )
+    parser.add_argument("sensor", help="sensor name, e.g. VIIRS_NPP")
+    parser.add_argument("data_path", help="directory with the archive csv files")
+    parser.add_argument("--out", default=None, help="output dataset directory")
+    parser.add_argument("--pattern", default="fire_archive*.csv")
+    parser.add_argument("--workers", type=int, default=0, help="0 for all cores")
+    args = parser.parse_args()
+    rows = convert_archive(args.sensor, args.data_path, args.out, args.pattern, args.workers)
+    print(f"{rows} rows written")
@@ -0,0 +1,92 @@
+"""
+Long running ingest daemon. Polls FIRMS for the nrt data of each
+configured sensor every interval and runs the nrt pipeline. Imports,
+land cover tiles, lookup tables, database connections and the
+clustering frontier (active detections) are kept in memory between
+cycles, so each cycle only does the new work. Stops after the
+current cycle on SIGTERM or SIGINT.
+"""
+import time
+import signal
+import threading
+
+import pandas as pd
+
+from activefire import config
+from activefire.firedata import prepare
+from activefire.firedata.populate_db import ProcSQL
+from activefire.firedata.orchestrate import sensor_lock
+
+
+class IngestDaemon(object):
+    def __init__(self, sensors: list[str] = None, interval: float = None):
+        cfg = config.config_dict["DAEMON"]
+        self.sensors = sensors or config.config_dict["TASKS"]["nrt_sensors"]
+        self.interval = interval or cfg["interval_minutes"] * 60
+        self.refresh = cfg["refresh_hours"] * 3600
+        self.procs = {}
+        self.stop_event = threading.Event()
+
+    def warm_proc(self, sensor: str) -> ProcSQL:
+        """ProcSQL of sensor keeping its database connection and
+        clustering frontier between cycles"""
+        if sensor not in self.procs:
+            proc = ProcSQL(sensor)
+            proc.db.keep_connection()
+            proc.keep_frontier = True
+            self.procs[sensor] = proc
+        return self.procs[sensor]
+
+    def stop(self, signum=None, frame=None):
+        print(f"stopping ingest daemon (signal {signum})")
+        self.stop_event.set()
+
+    def run_cycle(self):
+        """Run the nrt pipeline for each sensor, a failing sensor
+        does not stop the others"""
+        for sensor in self.sensors:
+            if self.stop_event.is_set():
+                break
+            start = time.perf_counter()
+            proc = self.warm_proc(sensor)
+            with sensor_lock(sensor) as acquired:
+                if not acquired:
+                    print(f"{sensor} is locked by another process, skipping")
+                    continue
+                try:
+                    new_data = proc.run_nrt()
+                except Exception as exc:
+                    print(f"{sensor} nrt update failed: {exc!r}")
+                    # reconnect and read the frontier from the database next cycle
+                    self.close_proc(sensor)
+                    continue
+            print(f"{sensor} new data: {new_data}, {time.perf_counter() - start:.1f} s")
+
+    def close_proc(self, sensor: str):
+        proc = self.procs.pop(sensor, None)
+        if proc is not None:
+            proc.db.close_connections()
+            proc.analytics.close()
+
+    def run(self):
+        """Poll until stopped"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        print(f"ingest daemon started: {self.sensors}, every {self.interval} s")
+        refreshed = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                print("cycle at", pd.Timestamp.utcnow())
+                self.run_cycle()
+                if time.monotonic() - refreshed > self.refresh:
+                    prepare.clear_caches()
+                    refreshed = time.monotonic()
+                self.stop_event.wait(self.interval)
+        finally:
+            for sensor in list(self.procs):
+                self.close_proc(sensor)
+            print("ingest daemon stopped")
+
+
+if __name__ == "__main__":
+    IngestDaemon().run()
@@ -1,16 +1,67 @@
 import os
+import stat
 import sqlite3
+import itertools
+import threading
+import contextlib
+import numpy as np
 import pandas as pd
 from sqlite3 import Error
 from activefire import config
-from activefire.firedata._utils import sql_datatypes
+from activefire.firedata._utils import sql_datatypes, detection_keys
+from activefire.firedata.parquet_store import filters_to_sql
+
+
+def concat_chunks(chunks) -> pd.DataFrame:
+    """Concatenate DataFrame chunks, empty DataFrame if there are none"""
+    chunks = list(chunks)
+    if len(chunks) == 0:
+        return pd.DataFrame()
+    return pd.concat(chunks).reset_index(drop=True)
+
+
+class _KeptConnection(sqlite3.Connection):
+    """Connection kept open between queries, see DataBase.keep_connection"""
+
+    def close(self):
+        pass
+
+    def release(self):
+        super().close()
 
 
 class DataBase(object):
-    def __init__(self, name):
+    def __init__(
+        self,
+        name,
+        read_only: bool = False,
+        partitioned: bool = None,
+        backend: str = None,
+    ):
         self.name = name
+        self.read_only = read_only
         data_path = config.config_dict["OS"]["data_path"]
         self.__db_file = os.path.join(data_path, name + ".db")
+        self.chunk_size = config.config_dict["DATABASE"]["query_chunk_size"]
+        self.spatial_index = config.config_dict["DATABASE"]["spatial_index"]
+        self._spatial_index_ready = False
+        self._kept = None
+        self._kept_all = []
+        self.dedup_keys = config.config_dict["DATABASE"]["dedup_keys"]
+        # extinct detections stored in per-year database files
+        if partitioned is None:
+            partitioned = config.config_dict["DATABASE"]["partition_by_year"]
+        self.partitioned = partitioned
+        self._partitions = {}
+        # extinct detections and events can be stored in parquet instead
+        if backend is None:
+            backend = config.config_dict["DATABASE"]["backend"]
+        self.store = None
+        if backend == "parquet":
+            from activefire.firedata.parquet_store import ParquetStore
+
+            self.store = ParquetStore(name)
+            self.partitioned = False
 
     def create_connection(self):
         """create a database connection to the SQLite database
@@ -18,13 +69,40 @@ class DataBase(object):
         wreturn: Connection object or None
         """
         conn = None
+        kwargs = {}
+        if self._kept is not None:
+            conn = getattr(self._kept, "conn", None)
+            if conn is not None:
+                return conn
+            # used by its thread only, but released by close_connections
+            kwargs = {"factory": _KeptConnection, "check_same_thread": False}
         try:
-            conn = sqlite3.connect(self.__db_file)
-            return conn
+            if self.read_only:
+                conn = sqlite3.connect(
+                    f"file:{self.__db_file}?mode=ro", uri=True, **kwargs
+                )
+            else:
+                conn = sqlite3.connect(self.__db_file, **kwargs)
         except Error as e:
             print(e)
+        if self._kept is not None and conn is not None:
+            self._kept.conn = conn
+            self._kept_all.append(conn)
         return conn
 
+    def keep_connection(self):
+        """Keep a connection per thread open and reuse it for all
+        queries, for long running processes"""
+        if self._kept is None:
+            self._kept = threading.local()
+
+    def close_connections(self):
+        """Close the connections kept by keep_connection"""
+        for conn in self._kept_all:
+            conn.release()
+        self._kept_all = []
+        self._kept = None
+
     def execute_sql(self, sql_string):
         """Execute sql_string"""
         with self.create_connection() as conn:
@@ -48,34 +126,544 @@ class DataBase(object):
             value = cur.fetchone()[0]
             return value
 
-    def return_many_values(self, sql_string: str):
-        """Query a single value"""
+    def return_many_values(self, sql_string: str, params=None):
+        """Query many values and return them as a DataFrame"""
         with self.create_connection() as conn:
-            dataset = pd.read_sql_query(sql_string, conn)
+            dataset = pd.read_sql_query(sql_string, conn, params=params)
             return dataset
 
+    def query_chunks(
+        self,
+        sql_string: str,
+        params=None,
+        chunk_size: int = None,
+        dtypes: dict = None,
+        arrow: bool = False,
+    ):
+        """Generator yielding the result of the sql_string query in
+        chunks of chunk_size rows (DATABASE query_chunk_size if not given).
+        Only one chunk is held in memory at a time. Chunks are
+        DataFrames with dtypes applied, or pyarrow RecordBatches
+        if arrow is True.
+        """
+        chunk_size = chunk_size or self.chunk_size
+        if arrow:
+            import pyarrow as pa
+        with contextlib.closing(self.create_connection()) as conn:
+            chunks = pd.read_sql_query(
+                sql_string, conn, params=params, chunksize=chunk_size
+            )
+            for chunk in chunks:
+                if dtypes:
+                    chunk = chunk.astype(
+                        {k: v for k, v in dtypes.items() if k in chunk}
+                    )
+                if arrow:
+                    chunk = pa.RecordBatch.from_pandas(chunk, preserve_index=False)
+                yield chunk
+
+    def select(
+        self,
+        table: str,
+        columns: list[str] = None,
+        where: str = None,
+        params=None,
+        chunk_size: int = None,
+        dtypes: dict = None,
+        arrow: bool = False,
+    ):
+        """Streaming SELECT of columns (all if None) from table, optionally
+        filtered by the where clause with ? placeholders bound to params.
+        See query_chunks.
+        """
+        projection = ", ".join(columns) if columns else "*"
+        sql_string = f"SELECT {projection} FROM {table}"
+        if where:
+            sql_string += f" WHERE {where}"
+        return self.query_chunks(
+            sql_string, params, chunk_size=chunk_size, dtypes=dtypes, arrow=arrow
+        )
+
+    def export_parquet(
+        self, sql_string: str, file_name, params=None, chunk_size=None, dtypes=None
+    ):
+        """Write the result of sql_string query to parquet file_name
+        chunk by chunk, in constant memory. Returns number of rows written.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        rows = 0
+        writer = None
+        try:
+            for batch in self.query_chunks(
+                sql_string, params, chunk_size=chunk_size, dtypes=dtypes, arrow=True
+            ):
+                if writer is None:
+                    writer = pq.ParquetWriter(file_name, batch.schema)
+                # keep the schema of the first chunk
+                table = pa.Table.from_batches([batch]).cast(writer.schema)
+                writer.write_table(table)
+                rows += batch.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
+
     def insert_dataset(self, dataset: pd.DataFrame, table: str, columns: list[str]):
-        """Insert dataset into the table in the database"""
+        """Insert dataset into the table in the database. Rows with the
+        primary key of an existing row replace it, so an interrupted
+        insert can be repeated."""
         dataset = dataset[list(columns)]
         records = dataset.values.tolist()
         qmks = ", ".join(["?"] * len(columns))
-        sql = f"""INSERT INTO {table} VALUES ({qmks})"""
+        sql = f"""INSERT OR REPLACE INTO {table} VALUES ({qmks})"""
         with self.create_connection() as conn:
             cur = conn.cursor()
             cur.executemany(sql, records)
             conn.commit()
 
     def insert_extinct(self, dataset):
+        if self.store is not None:
+            self.store.insert_extinct(dataset)
+            return
+        if self.partitioned:
+            self.insert_partitioned(dataset)
+            return
         columns = sql_datatypes["SQL_detections_dtypes"].keys()
         self.insert_dataset(dataset, "detections_extinct", columns)
+        self.index_detections(dataset)
 
     def insert_active(self, dataset):
         columns = sql_datatypes["SQL_detections_dtypes"].keys()
         self.insert_dataset(dataset, "detections_active", columns)
+        self.index_detections(dataset)
 
     def insert_events(self, dataset):
         columns = sql_datatypes["SQL_events_dtypes"].keys()
         self.insert_dataset(dataset, "events", columns)
+        self.index_events(dataset)
+        if self.store is not None:
+            self.store.insert_events(dataset)
+
+    def insert_keys(self, dataset: pd.DataFrame):
+        """Add dataset detections to the detection_keys index"""
+        if not self.dedup_keys or len(dataset) == 0:
+            return
+        keys = detection_keys(dataset.longitude, dataset.latitude, dataset.date)
+        self.execute_sql(config.config_dict["SQL"]["sql_create_keys_table"])
+        with self.create_connection() as conn:
+            cur = conn.cursor()
+            cur.executemany(
+                "INSERT OR IGNORE INTO detection_keys VALUES (?)",
+                ((int(x),) for x in keys),
+            )
+            conn.commit()
+
+    def known_keys(self, keys) -> np.ndarray:
+        """Boolean mask of keys (see detection_keys) present in
+        the detection_keys index. Only the keys within the time range
+        of keys are read."""
+        keys = np.asarray(keys, dtype=np.int64)
+        if not self.dedup_keys or len(keys) == 0:
+            return np.zeros(len(keys), dtype=bool)
+        if not self.table_exists("detection_keys"):
+            return np.zeros(len(keys), dtype=bool)
+        # whole minutes of the time range
+        start_key = (keys.min() >> 37) << 37
+        end_key = ((keys.max() >> 37) + 1 << 37) - 1
+        with contextlib.closing(self.create_connection()) as conn:
+            rows = conn.execute(
+                "SELECT key FROM detection_keys WHERE key BETWEEN ? AND ?",
+                (int(start_key), int(end_key)),
+            ).fetchall()
+        known = np.fromiter((x[0] for x in rows), dtype=np.int64, count=len(rows))
+        return np.isin(keys, known)
+
+    def partition(self, year: int):
+        """Return DataBase of the year partition of detections_extinct.
+        Finalised partitions are opened read-only."""
+        if year not in self._partitions:
+            final = False
+            if self.table_exists("partitions"):
+                final = bool(
+                    self.return_single_value(
+                        f"SELECT count(*) FROM partitions WHERE year = {int(year)} AND final = 1"
+                    )
+                )
+            part = DataBase(
+                f"{self.name}_{year}", read_only=final, partitioned=False, backend="sqlite"
+            )
+            if not final:
+                part.execute_sql(config.config_dict["SQL"]["sql_create_extinct_table"])
+                # new partitions of an indexed database are indexed from the start
+                if self.spatial_index_ready():
+                    part.create_spatial_index()
+            self._partitions[year] = part
+        return self._partitions[year]
+
+    def partitions_catalogue(self) -> pd.DataFrame:
+        """Return the partitions catalogue table as DataFrame"""
+        self.execute_sql(config.config_dict["SQL"]["sql_create_partitions_table"])
+        return self.return_many_values("SELECT * FROM partitions ORDER BY year")
+
+    def partition_years(self, time_range: tuple = None) -> list[int]:
+        """Years of partitions holding detections within time_range
+        (start, end), all partitions if time_range is None"""
+        catalogue = self.partitions_catalogue()
+        if time_range is not None:
+            start_date, end_date = [
+                int(pd.Timestamp(x).timestamp()) for x in time_range
+            ]
+            catalogue = catalogue[
+                (catalogue.max_date >= start_date) & (catalogue.min_date <= end_date)
+            ]
+        return catalogue.year.tolist()
+
+    def insert_partitioned(self, dataset: pd.DataFrame):
+        """Insert extinct detections into the year partitions and
+        update the partitions catalogue"""
+        self.execute_sql(config.config_dict["SQL"]["sql_create_partitions_table"])
+        years = pd.to_datetime(dataset["date"], unit="s").dt.year
+        for year, part_dataset in dataset.groupby(years.values):
+            part = self.partition(year)
+            if part.read_only:
+                raise ValueError(f"Partition {part.name} is finalised (read-only)")
+            rows = part.insert_counted(part_dataset)
+            self.run_sql(
+                f"""INSERT INTO partitions VALUES
+                ({int(year)}, {int(part_dataset.date.min())},
+                {int(part_dataset.date.max())}, {int(part_dataset.id.max())},
+                {int(rows)}, 0)
+                ON CONFLICT(year) DO UPDATE SET
+                min_date = min(min_date, excluded.min_date),
+                max_date = max(max_date, excluded.max_date),
+                max_id = max(max_id, excluded.max_id),
+                rows = excluded.rows"""
+            )
+
+    def insert_counted(self, dataset: pd.DataFrame) -> int:
+        """Insert extinct detections into this year partition, rows
+        already present are skipped. The partition_rows counter is
+        increased by the rows inserted in the same transaction, so it
+        stays exact when an interrupted insert is repeated. Returns the
+        number of rows of the partition."""
+        columns = sql_datatypes["SQL_detections_dtypes"].keys()
+        records = dataset[list(columns)].values.tolist()
+        qmks = ", ".join(["?"] * len(columns))
+        with contextlib.closing(self.create_connection()) as conn:
+            conn.execute(config.config_dict["SQL"]["sql_create_partition_rows_table"])
+            if conn.execute("SELECT count(*) FROM partition_rows").fetchone()[0] == 0:
+                # partitions created before the counter, counted once
+                conn.execute(
+                    "INSERT INTO partition_rows SELECT count(*) FROM detections_extinct"
+                )
+            changes = conn.total_changes
+            conn.executemany(
+                f"INSERT OR IGNORE INTO detections_extinct VALUES ({qmks})", records
+            )
+            conn.execute(
+                "UPDATE partition_rows SET rows = rows + ?",
+                (conn.total_changes - changes,),
+            )
+            conn.commit()
+            rows = conn.execute("SELECT rows FROM partition_rows").fetchone()[0]
+        self.index_detections(dataset)
+        return rows
+
+    def finalise_partition(self, year: int):
+        """Finalise a closed year partition: analyze and vacuum it,
+        make the file read-only and mark it final in the catalogue.
+        No detections can be inserted into the partition afterwards."""
+        part = self.partition(year)
+        if part.read_only:
+            return
+        print(f"finalising partition {part.name}")
+        # made read-only by an interrupted finalise, only the catalogue is
+        # left. The mode bits are checked, root can write read-only files
+        if os.stat(part.db_file).st_mode & stat.S_IWUSR:
+            if self.spatial_index_ready():
+                part.create_spatial_index()
+            part.execute_sql("ANALYZE")
+            conn = part.create_connection()
+            conn.execute("VACUUM")
+            conn.close()
+            os.chmod(part.db_file, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        self.run_sql(f"UPDATE partitions SET final = 1 WHERE year = {int(year)}")
+        self._partitions[year] = DataBase(
+            part.name, read_only=True, partitioned=False, backend="sqlite"
+        )
+
+    def finalise_closed_partitions(self, min_active_date: int):
+        """Finalise all partitions of years before the year of
+        min_active_date (unixepoch) - no extinct detections can be
+        added to these any more."""
+        if not self.partitioned or min_active_date is None:
+            return
+        active_year = pd.to_datetime(min_active_date, unit="s").year
+        catalogue = self.partitions_catalogue()
+        closed = catalogue[(catalogue.final == 0) & (catalogue.year < active_year)]
+        for year in closed.year:
+            self.finalise_partition(year)
+
+    def migrate_to_partitions(self):
+        """Move detections from the detections_extinct table of the
+        main database file into year partitions"""
+        for chunk in self.select(
+            "detections_extinct", dtypes=sql_datatypes["SQL_detections_dtypes"]
+        ):
+            self.insert_partitioned(chunk)
+        self.run_sql("DELETE FROM detections_extinct")
+        if self.table_exists("detections_rtree"):
+            self.run_sql(
+                "DELETE FROM detections_rtree WHERE id NOT IN (SELECT id FROM detections_active)"
+            )
+
+    def extinct_chunks(
+        self,
+        columns: list[str] = None,
+        where: str = None,
+        params=None,
+        time_range: tuple = None,
+        chunk_size: int = None,
+        filters: list[tuple] = None,
+    ):
+        """Streaming select from detections_extinct (see select).
+        filters is a list of (column, op, value) conditions and works with
+        all storage backends, the sql where clause only with sqlite. If
+        the storage is partitioned, only the partitions overlapping
+        time_range are queried."""
+        if self.store is not None:
+            if where is not None:
+                raise ValueError("sql where clause is not supported by parquet store")
+            return self.store.iter_batches(
+                "detections", columns, filters, time_range, chunk_size
+            )
+        dtypes = sql_datatypes["SQL_detections_dtypes"]
+        if filters:
+            filters_where, filters_params = filters_to_sql(filters)
+            where = f"({where}) AND {filters_where}" if where else filters_where
+            params = list(params or []) + filters_params
+        if time_range is not None:
+            start_date, end_date = [
+                int(pd.Timestamp(x).timestamp()) for x in time_range
+            ]
+            time_where = f"date >= {start_date} AND date <= {end_date}"
+            where = f"({where}) AND {time_where}" if where else time_where
+        if not self.partitioned:
+            return self.select(
+                "detections_extinct", columns, where, params, chunk_size, dtypes
+            )
+        return itertools.chain.from_iterable(
+            self.partition(year).select(
+                "detections_extinct", columns, where, params, chunk_size, dtypes
+            )
+            for year in self.partition_years(time_range)
+        )
+
+    def max_extinct_id(self):
+        """Max id of the extinct detections, None if there are none"""
+        if self.store is not None:
+            return self.store.max_id()
+        if not self.partitioned:
+            return self.return_single_value("SELECT max(id) FROM detections_extinct")
+        max_id = self.partitions_catalogue().max_id.max()
+        return None if pd.isna(max_id) else int(max_id)
+
+    @property
+    def db_file(self):
+        return self.__db_file
+
+    def table_exists(self, table: str) -> bool:
+        """Check if table exists in the database"""
+        sql_string = "SELECT count(*) FROM sqlite_master WHERE name = ?"
+        with self.create_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(sql_string, (table,))
+            return cur.fetchone()[0] > 0
+
+    def spatial_index_ready(self) -> bool:
+        """True if the spatial index is enabled (DATABASE spatial_index)
+        and has been built (create_spatial_index). Only then it is
+        updated with each insert and delete and used by query_bbox."""
+        if not self.spatial_index:
+            return False
+        if not self._spatial_index_ready:
+            self._spatial_index_ready = self.table_exists(
+                "detections_rtree"
+            ) and self.table_exists("events_rtree")
+        return self._spatial_index_ready
+
+    def create_spatial_index(self):
+        """Create the R*Tree virtual tables indexing detections (by id)
+        and events (by event, using event median position) if these do
+        not exist, and fill them from the rows already in the database.
+        Slow for large databases, run explicitly (see __main__).
+        """
+        sql = config.config_dict["SQL"]
+        if not self.table_exists("detections_rtree"):
+            self.execute_sql(sql["sql_create_detections_rtree"])
+            for table in ["detections_extinct", "detections_active"]:
+                if self.table_exists(table):
+                    self.run_sql(
+                        f"""INSERT OR REPLACE INTO detections_rtree
+                        SELECT id, longitude, longitude, latitude, latitude,
+                        date, date FROM {table}"""
+                    )
+        if not self.table_exists("events_rtree"):
+            self.execute_sql(sql["sql_create_events_rtree"])
+            if self.table_exists("events"):
+                self.run_sql(
+                    """INSERT OR REPLACE INTO events_rtree
+                    SELECT event, longitude, longitude, latitude, latitude,
+                    start_date, last_date FROM events"""
+                )
+        self._spatial_index_ready = True
+
+    def _insert_rtree(self, table: str, records: list):
+        sql = f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?, ?, ?, ?)"
+        with self.create_connection() as conn:
+            cur = conn.cursor()
+            cur.executemany(sql, records)
+            conn.commit()
+
+    def index_detections(self, dataset: pd.DataFrame):
+        """Add dataset detections to the spatial index"""
+        if not self.spatial_index_ready():
+            return
+        records = dataset[
+            ["id", "longitude", "longitude", "latitude", "latitude", "date", "date"]
+        ].values.tolist()
+        self._insert_rtree("detections_rtree", records)
+
+    def index_events(self, dataset: pd.DataFrame):
+        """Add dataset events to the spatial index"""
+        if not self.spatial_index_ready():
+            return
+        records = dataset[
+            [
+                "event",
+                "longitude",
+                "longitude",
+                "latitude",
+                "latitude",
+                "start_date",
+                "last_date",
+            ]
+        ].values.tolist()
+        self._insert_rtree("events_rtree", records)
+
+    def unindex_active(self, events: bool = True):
+        """Remove active detections and (if events) active events from
+        the spatial index. Must be called before these are deleted from
+        the database.
+        """
+        if not self.spatial_index_ready():
+            return
+        self.execute_sql(
+            """DELETE FROM detections_rtree
+            WHERE id IN (SELECT id FROM detections_active)"""
+        )
+        if events:
+            self.execute_sql(
+                """DELETE FROM events_rtree
+                WHERE event IN (SELECT event FROM events WHERE active = 1)"""
+            )
+
+    def delete_events(self, events: list[int]):
+        """Delete events (and their spatial index entries) by event label"""
+        records = [(int(x),) for x in events]
+        if len(records) == 0:
+            return
+        indexed = self.spatial_index_ready()
+        with self.create_connection() as conn:
+            cur = conn.cursor()
+            if indexed:
+                cur.executemany("DELETE FROM events_rtree WHERE event = ?", records)
+            cur.executemany("DELETE FROM events WHERE event = ?", records)
+            conn.commit()
+
+    def query_bbox(
+        self,
+        bbox: list[float],
+        time_range: tuple = None,
+        table: str = "detections_extinct",
+        columns: list[str] = None,
+        chunk_size: int = None,
+    ):
+        """Select rows of table (detections_extinct, detections_active
+        or events) within bbox using the R*Tree spatial index, if it
+        is ready (spatial_index_ready), by a table scan otherwise.
+        Args:
+            bbox - (list) [North, West, South, East], as in spatial_subset_dfr
+            time_range - (tuple) optional (start, end) datetimes, inclusive.
+                Events are selected if they overlap the time range.
+            columns - (list) columns to return, all if None
+            chunk_size - if given, a generator of chunks is returned
+                instead of a DataFrame (see query_chunks)
+        Returns:
+            pandas DataFrame
+        """
+        if table == "detections_extinct" and self.store is not None:
+            north, west, south, east = bbox
+            filters = [
+                ("latitude", "<", north),
+                ("latitude", ">", south),
+                ("longitude", ">", west),
+                ("longitude", "<", east),
+            ]
+            chunks = self.store.iter_batches(
+                "detections", columns, filters, time_range, chunk_size
+            )
+            return chunks if chunk_size else concat_chunks(chunks)
+        if table == "detections_extinct" and self.partitioned:
+            chunks = itertools.chain.from_iterable(
+                self.partition(year).query_bbox(
+                    bbox, time_range, table, columns, chunk_size or self.chunk_size
+                )
+                for year in self.partition_years(time_range)
+            )
+            return chunks if chunk_size else concat_chunks(chunks)
+        if table == "events":
+            rtree, key, start, end = "events_rtree", "event", "start_date", "last_date"
+        else:
+            rtree, key, start, end = "detections_rtree", "id", "date", "date"
+        projection = ", ".join(f"t.{col}" for col in columns) if columns else "t.*"
+        north, west, south, east = bbox
+        indexed = self.spatial_index_ready()
+        if indexed:
+            sql_string = f"""SELECT {projection} FROM {rtree} r
+                JOIN {table} t ON t.{key} = r.{key}
+                WHERE r.max_lat >= ? AND r.min_lat <= ?
+                AND r.max_lon >= ? AND r.min_lon <= ?
+                AND t.latitude < ? AND t.latitude > ?
+                AND t.longitude > ? AND t.longitude < ?"""
+            params = [south, north, west, east, north, south, west, east]
+        else:
+            sql_string = f"""SELECT {projection} FROM {table} t
+                WHERE t.latitude < ? AND t.latitude > ?
+                AND t.longitude > ? AND t.longitude < ?"""
+            params = [north, south, west, east]
+        if time_range is not None:
+            start_date, end_date = [
+                int(pd.Timestamp(x).timestamp()) for x in time_range
+            ]
+            if indexed:
+                sql_string += " AND r.max_date >= ? AND r.min_date <= ?"
+                params += [start_date, end_date]
+            sql_string += f" AND t.{end} >= ? AND t.{start} <= ?"
+            params += [start_date, end_date]
+        dtypes = (
+            sql_datatypes["SQL_events_dtypes"]
+            if table == "events"
+            else sql_datatypes["SQL_detections_dtypes"]
+        )
+        chunks = self.query_chunks(
+            sql_string, params, chunk_size=chunk_size, dtypes=dtypes
+        )
+        if chunk_size:
+            return chunks
+        return concat_chunks(chunks)
 
     def spin_up_fire_database(self, sql_list):
         """Convenience methot to create database and create the tables
@@ -86,8 +674,20 @@ class DataBase(object):
 
 
 if __name__ == "__main__":
-    name = "test"
-    db = DataBase(name)
-    # db.spin_up_fire_database([sql_create_detections_table, sql_create_events_table])
-    # db.create_table(sql_create_detections_table)
-    # wdb.create_table(sql_create_events_table)
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Build the R*Tree spatial index of a sensor database"
+    )
+    parser.add_argument("sensor", help="sensor name, e.g. VIIRS_NPP")
+    args = parser.parse_args()
+    db = DataBase(args.sensor)
+    db.create_spatial_index()
+    if db.partitioned and db.store is None:
+        for year in db.partition_years():
+            part = db.partition(year)
+            if part.read_only:
+                print(f"partition {part.name} is finalised (read-only), skipping")
+                continue
+            part.create_spatial_index()
+    print(f"spatial index of {args.sensor} built")
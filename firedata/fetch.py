@@ -8,17 +8,16 @@ author: tadas.nik@gmail.com
 
 """
 import logging
-import requests
 import pandas as pd
 from io import BytesIO
-from requests.auth import AuthBase
+from activefire.firedata import metrics
 
 # Place your LANCE NRT token as variable (NRT_TOKEN) in
 # .env file in project root. The below uses dotenv to read
 # the token.
 
 
-class NRTAuth(AuthBase):
+class NRTAuth(object):
     """Implementation of authorization using the LANCE (eosdis)
     nrt (near-real time) data access token.
     This is called during http request setup"""
@@ -34,8 +33,13 @@ class FetchNRT():
     """Class for fetching active fires near-real time (nrt) data from FIRMS"""
     def __init__(self, sensor: str, nrt_token: str, base_url: str):
         self.sensor = sensor
+        import requests
+
         self.auth = NRTAuth(nrt_token)
         self.base_url = base_url
+        # keeps the connection to FIRMS open between requests
+        self.session = requests.Session()
+        self.session.auth = self.auth
         self.logger = self.setup_logger()
 
     def setup_logger(self):
@@ -43,6 +47,8 @@ class FetchNRT():
         log_file_name = self.__class__.__name__ + '.log'
         logger = logging.getLogger(f'{self.sensor}')
         logger.setLevel(logging.INFO)
+        if logger.handlers:
+            return logger
         # create console handler and set level to debug
         log_handler = logging.FileHandler(filename=log_file_name)
         log_handler.setLevel(logging.INFO)
@@ -64,12 +70,18 @@ class FetchNRT():
         Returns:
             DataFrame with available active fire data for the day.
         """
+        import requests
+
         url = self.day_url(date)
         try:
-            response = requests.get(url, auth=self.auth)
+            with metrics.stage(self.sensor, "fetch") as rec:
+                response = self.session.get(url)
+                rec["bytes"] = len(response.content)
             response.raise_for_status()
-            dfr = pd.read_table(BytesIO(response.content),
-                                sep=',', header=0)
+            with metrics.stage(self.sensor, "parse") as rec:
+                dfr = pd.read_table(BytesIO(response.content),
+                                    sep=',', header=0)
+                rec["rows_out"] = len(dfr)
             self.logger.info('fetched nrt for day: ' +
                              date.strftime('%Y-%m-%d'))
         except requests.exceptions.HTTPError as err:
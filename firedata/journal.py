@@ -0,0 +1,70 @@
+"""
+Journal of checkpointed nrt pipeline runs. Records the last completed
+stage (fetched, transformed, loaded) with sha256 hashes of the staged
+files it wrote, and the completed steps of the load stage, so that a
+run restarted after a failure resumes where the previous one stopped.
+"""
+import json
+import hashlib
+from pathlib import Path
+
+import pandas as pd
+
+
+def file_sha256(path) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class RunJournal(object):
+    """Run journal stored as json at path, written atomically"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entry = self.read()
+
+    def read(self) -> dict:
+        if not self.path.exists():
+            return {"stage": None, "files": {}, "steps": []}
+        with open(self.path) as fp:
+            return json.load(fp)
+
+    def write(self):
+        self.entry["updated"] = pd.Timestamp.utcnow().isoformat()
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump(self.entry, fp, indent=2)
+        tmp_path.rename(self.path)
+
+    @property
+    def stage(self):
+        return self.entry["stage"]
+
+    @property
+    def steps(self) -> list[str]:
+        return self.entry["steps"]
+
+    def complete(self, stage: str, files: list = None):
+        """Record stage as completed, with the hashes of the staged
+        files written by it"""
+        self.entry = {
+            "stage": stage,
+            "files": {str(x): file_sha256(x) for x in files or []},
+            "steps": [],
+        }
+        self.write()
+
+    def step_done(self, step: str):
+        """Record a completed step of the current stage"""
+        self.entry["steps"].append(step)
+        self.write()
+
+    def verify(self) -> bool:
+        """True if the staged files of the last stage are unchanged"""
+        for file_name, sha in self.entry["files"].items():
+            if not Path(file_name).exists() or file_sha256(file_name) != sha:
+                return False
+        return True
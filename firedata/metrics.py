@@ -0,0 +1,215 @@
+"""
+Per-stage performance metrics of the fire data pipelines. Stages
+(fetch, parse, date conversion, admin sampling, land cover,
+clustering, event aggregation, delete, insert ...) are timed with
+the stage context manager, which accumulates wall time, CPU time,
+rows in/out, bytes and peak RSS per stage. CPU time is that of the
+whole process, so stages running concurrently (pipeline_to_db)
+include each other's. The peak RSS is that of the process during the
+stage on Linux (see StagePeak), the lifetime peak elsewhere. flush
+writes them as json lines to <data_path>/<METRICS path>/<sensor>_metrics.jsonl
+and as a Prometheus text format file <sensor>.prom (node exporter
+textfile collector) in the same directory.
+"""
+import sys
+import json
+import time
+import resource
+import threading
+import contextlib
+from pathlib import Path
+
+import pandas as pd
+
+from activefire import config
+
+_fields = ["wall_seconds", "cpu_seconds", "rows_in", "rows_out", "bytes"]
+_help = {
+    "wall_seconds": "Wall time of the stage",
+    "cpu_seconds": "CPU time of the process (all threads) during the stage",
+    "rows_in": "Rows passed to the stage",
+    "rows_out": "Rows returned by the stage",
+    "bytes": "Bytes transferred by the stage",
+    "peak_rss_bytes": "Peak resident set size of the process during the stage",
+    "calls": "Number of times the stage ran",
+    "timestamp_seconds": "Unix time the stage metrics were written",
+}
+
+
+def peak_rss() -> int:
+    """Peak resident set size of the process in bytes, since the last
+    reset_peak_rss on Linux"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak resident set size of the process to the current
+    one (Linux only), False if it can not be reset"""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return False
+    return True
+
+
+class StagePeak(object):
+    """Peak RSS of the process during a stage. The peak is reset when a
+    stage starts, after folding the peak so far into the stages already
+    running, so nested and concurrent stages each get their own peak.
+    Without reset_peak_rss it is the lifetime peak of the process."""
+
+    _running = []
+    _lock = threading.Lock()
+    _resettable = None
+
+    def __init__(self):
+        self.peak = 0
+        cls = StagePeak
+        with cls._lock:
+            if cls._resettable is not False:
+                current = peak_rss()
+                for other in cls._running:
+                    other.peak = max(other.peak, current)
+                cls._resettable = reset_peak_rss()
+            cls._running.append(self)
+
+    def stop(self) -> int:
+        """Stop tracking, returns the peak RSS of the stage in bytes"""
+        with StagePeak._lock:
+            StagePeak._running.remove(self)
+            self.peak = max(self.peak, peak_rss())
+        return self.peak
+
+
+class Metrics(object):
+    """Stage metrics of the pipeline runs of a sensor"""
+
+    def __init__(self, sensor: str):
+        self.sensor = sensor
+        cfg = config.config_dict["METRICS"]
+        self.enabled = cfg["enabled"]
+        self.root = Path(config.config_dict["OS"]["data_path"], cfg["path"])
+        # stage totals since the last flush
+        self.totals = {}
+        # last flushed totals of each stage, written to the .prom file
+        self.latest = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, rows_in: int = None):
+        """Time the enclosed block as stage name. Yields a dict in which
+        rows_out and bytes can be set."""
+        record = {"rows_in": rows_in, "rows_out": None, "bytes": None}
+        if not self.enabled:
+            yield record
+            return
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        peak = StagePeak()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu
+            record["peak_rss_bytes"] = peak.stop()
+            self.add(name, record)
+
+    def add(self, name: str, record: dict):
+        with self._lock:
+            total = self.totals.setdefault(name, {"calls": 0})
+            for field in _fields:
+                if record.get(field) is not None:
+                    total[field] = total.get(field, 0) + record[field]
+            total["calls"] += 1
+            total["peak_rss_bytes"] = max(
+                total.get("peak_rss_bytes", 0), record["peak_rss_bytes"]
+            )
+
+    def take(self) -> dict:
+        """Return and reset the stage totals, to be merged into the
+        metrics of another (the parent) process"""
+        with self._lock:
+            totals, self.totals = self.totals, {}
+        return totals
+
+    def merge(self, totals: dict):
+        """Add stage totals taken from another process"""
+        with self._lock:
+            for name, other in totals.items():
+                total = self.totals.setdefault(name, {"calls": 0})
+                for field in _fields + ["calls"]:
+                    if field in other:
+                        total[field] = total.get(field, 0) + other[field]
+                total["peak_rss_bytes"] = max(
+                    total.get("peak_rss_bytes", 0), other["peak_rss_bytes"]
+                )
+
+    def flush(self):
+        """Write the stage totals since the last flush and reset them"""
+        with self._lock:
+            totals, self.totals = self.totals, {}
+        if len(totals) == 0:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        now = pd.Timestamp.utcnow()
+        with open(Path(self.root, f"{self.sensor}_metrics.jsonl"), "a") as fp:
+            for name, total in totals.items():
+                line = {"time": now.isoformat(), "sensor": self.sensor, "stage": name}
+                fp.write(json.dumps({**line, **total}) + "\n")
+                print(
+                    f"{name}: {total.get('wall_seconds', 0):.2f} s wall, "
+                    f"{total.get('cpu_seconds', 0):.2f} s cpu, "
+                    f"rows {total.get('rows_in')} -> {total.get('rows_out')}"
+                )
+        for total in totals.values():
+            total["timestamp_seconds"] = now.timestamp()
+        self.latest.update(totals)
+        self.write_prometheus()
+
+    def write_prometheus(self):
+        """Write the latest stage totals in Prometheus text format,
+        atomically (via rename)"""
+        lines = []
+        for field, help_text in _help.items():
+            metric = f"activefire_stage_{field}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            for name, total in sorted(self.latest.items()):
+                if field in total:
+                    labels = f'sensor="{self.sensor}",stage="{name}"'
+                    lines.append(f"{metric}{{{labels}}} {total[field]}")
+        path = Path(self.root, f"{self.sensor}.prom")
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text("\n".join(lines) + "\n")
+        tmp_path.rename(path)
+
+
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+def recorder(sensor: str) -> Metrics:
+    """Metrics of sensor, one per process"""
+    with _recorders_lock:
+        if sensor not in _recorders:
+            _recorders[sensor] = Metrics(sensor)
+        return _recorders[sensor]
+
+
+def stage(sensor: str, name: str, rows_in: int = None):
+    """Time the enclosed block as stage name of sensor, see Metrics.stage"""
+    return recorder(sensor).stage(name, rows_in)
+
+
+def flush(sensor: str):
+    recorder(sensor).flush()
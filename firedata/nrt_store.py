@@ -0,0 +1,166 @@
+"""
+Append-only store of fetched near-real time (nrt) FIRMS data. Each
+fetch is written as a new parquet fragment named by the date range it
+covers, detections already stored are dropped using their
+detection_keys. Fragments are merged into monthly files by compaction
+and fragments preceding the archive end are dropped as a whole.
+"""
+import re
+import uuid
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from activefire import config
+from activefire.firedata._utils import FireDate, detection_keys
+
+_fragment_name = re.compile(r"^(\d{8}T\d{4})_(\d{8}T\d{4})_(\w+)\.parquet$")
+_date_format = "%Y%m%dT%H%M"
+
+
+def _utc(date) -> pd.Timestamp:
+    date = pd.Timestamp(date)
+    if date.tzinfo is None:
+        return date.tz_localize("utc")
+    return date.tz_convert("utc")
+
+
+class NRTStore(object):
+    """Fragments of the nrt dataset of a sensor, dataset date column
+    holds datetimes (see PrepData.prepare_nrt_dataset)."""
+
+    # serialises fragment writes and deletes, compaction included
+    _lock = threading.Lock()
+
+    def __init__(self, sensor: str):
+        self.sensor = sensor
+        cfg = config.config_dict["DATABASE"]
+        self.root = Path(config.config_dict["OS"]["data_path"], cfg["nrt_store_path"], sensor)
+        self.compact_min_fragments = cfg["nrt_compact_min_fragments"]
+        self._compaction = None
+
+    def fragments(self, time_range: tuple = None) -> list[tuple]:
+        """(start, end, path) of the fragments overlapping time_range
+        (start, end), all if None, sorted by start"""
+        fragments = []
+        for path in self.root.glob("*.parquet"):
+            match = _fragment_name.match(path.name)
+            if match is None:
+                continue
+            start, end = [pd.Timestamp(x, tz="utc") for x in match.groups()[:2]]
+            if time_range is not None:
+                if end < _utc(time_range[0]) or start > _utc(time_range[1]):
+                    continue
+            fragments.append((start, end, path))
+        return sorted(fragments, key=lambda x: (x[0], x[1]))
+
+    def write_fragment(self, dataset: pd.DataFrame) -> Path:
+        """Write dataset as a fragment, atomically (via rename)"""
+        start = dataset.date.min().strftime(_date_format)
+        end = dataset.date.max().strftime(_date_format)
+        path = Path(self.root, f"{start}_{end}_{uuid.uuid4().hex[:8]}.parquet")
+        tmp_path = path.with_suffix(".tmp")
+        dataset.to_parquet(tmp_path, index=False)
+        tmp_path.rename(path)
+        return path
+
+    def stored_keys(self, time_range: tuple) -> np.ndarray:
+        """Keys of the detections stored within time_range, only the
+        key column of the overlapping fragments is read"""
+        keys = [
+            pd.read_parquet(path, columns=["key"]).key.values
+            for _, _, path in self.fragments(time_range)
+        ]
+        if len(keys) == 0:
+            return np.array([], dtype=np.int64)
+        return np.concatenate(keys)
+
+    def append(self, nrt_new: pd.DataFrame) -> int:
+        """Append the prepared nrt dataset (nrt_new) as a new fragment,
+        dropping the detections already stored. Returns the number of
+        detections added."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        keys = detection_keys(
+            nrt_new.longitude, nrt_new.latitude, FireDate.unix_time(nrt_new.date)
+        )
+        nrt_new = nrt_new.assign(key=keys)
+        nrt_new = nrt_new[~nrt_new.key.duplicated()]
+        with self._lock:
+            stored = self.stored_keys((nrt_new.date.min(), nrt_new.date.max()))
+            nrt_new = nrt_new[~np.isin(nrt_new.key.values, stored)]
+            if len(nrt_new) == 0:
+                print("No new fire detections, snooze")
+                return 0
+            print(f"Adding {len(nrt_new)} active fires to nrt record")
+            self.write_fragment(nrt_new.sort_values("date").reset_index(drop=True))
+        if len(self.fragments()) >= self.compact_min_fragments:
+            self.compact(background=True)
+        return len(nrt_new)
+
+    def read(self, time_range: tuple = None, columns: list[str] = None) -> pd.DataFrame:
+        """Read the nrt dataset (within time_range (start, end)). The key
+        column is dropped unless in columns."""
+        fragments = self.fragments(time_range)
+        if len(fragments) == 0:
+            return pd.DataFrame()
+        read_columns = None if columns is None else list(set(columns) | {"key", "date"})
+        dfr = pd.concat(
+            [pd.read_parquet(path, columns=read_columns) for _, _, path in fragments]
+        )
+        # a fragment may be read together with its compacted copy
+        dfr = dfr[~dfr.key.duplicated()]
+        if time_range is not None:
+            start, end = [_utc(x) for x in time_range]
+            dfr = dfr[(dfr.date >= start) & (dfr.date <= end)]
+        if columns is None:
+            columns = [x for x in dfr.columns if x != "key"]
+        return dfr[columns].sort_values("date").reset_index(drop=True)
+
+    def last_date(self):
+        """Datetime of the last stored detection, None if empty"""
+        fragments = self.fragments()
+        if len(fragments) == 0:
+            return None
+        return max(x[1] for x in fragments)
+
+    def compact(self, background: bool = False):
+        """Merge the fragments of each month into one. With background
+        the compaction runs in a thread, which is returned."""
+        if background:
+            if self._compaction is not None and self._compaction.is_alive():
+                return self._compaction
+            self._compaction = threading.Thread(target=self.compact)
+            self._compaction.start()
+            return self._compaction
+        with self._lock:
+            fragments = self.fragments()
+            months = {}
+            for start, end, path in fragments:
+                # fragments spanning months are left as they are
+                if (start.year, start.month) == (end.year, end.month):
+                    months.setdefault((start.year, start.month), []).append(path)
+            for month, paths in months.items():
+                if len(paths) < 2:
+                    continue
+                print(f"compacting {len(paths)} nrt fragments of {month}")
+                merged = pd.concat([pd.read_parquet(x) for x in paths])
+                merged = merged[~merged.key.duplicated()]
+                self.write_fragment(merged.sort_values("date").reset_index(drop=True))
+                for path in paths:
+                    path.unlink()
+
+    def drop_in_archive(self, archive_end):
+        """Drop nrt data up to archive_end datetime. Whole fragments
+        preceding archive_end are deleted, only a fragment spanning
+        it is rewritten."""
+        archive_end = _utc(archive_end)
+        with self._lock:
+            for start, end, path in self.fragments():
+                if end <= archive_end:
+                    path.unlink()
+                elif start <= archive_end:
+                    dfr = pd.read_parquet(path)
+                    self.write_fragment(dfr[dfr.date > archive_end])
+                    path.unlink()
@@ -0,0 +1,129 @@
+"""
+Runs the nrt fetch, transform and load pipeline of several sensors
+concurrently, one worker process per sensor. Each sensor has its own
+database file, a per-sensor lock file keeps overlapping runs (cron,
+daemon) from updating the same database. Land cover tiles and the
+continents table are memory mapped by the workers from the shared
+lookups directory (TASKS shared_lookups_path), one copy for all.
+"""
+import os
+import sys
+import time
+import fcntl
+import logging
+import argparse
+import contextlib
+import multiprocessing
+import concurrent.futures
+from pathlib import Path
+
+from activefire import config
+
+logger = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def sensor_lock(sensor: str):
+    """Non-blocking exclusive lock of the sensor database, yields
+    False if it is held by another process"""
+    lock_path = Path(config.config_dict["OS"]["data_path"], f"{sensor}.lock")
+    with open(lock_path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            lock_file.truncate(0)
+            lock_file.write(str(os.getpid()))
+            lock_file.flush()
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def run_sensor(sensor: str) -> tuple:
+    """Process pool worker: runs the nrt pipeline of sensor unless it
+    is locked. Returns (sensor, new data loaded or None if locked,
+    seconds taken)"""
+    from activefire.firedata.populate_db import ProcSQL
+
+    start = time.perf_counter()
+    with sensor_lock(sensor) as acquired:
+        if not acquired:
+            print(f"{sensor} is locked by another process, skipping")
+            return sensor, None, 0.0
+        new_data = ProcSQL(sensor).run_nrt()
+    return sensor, new_data, time.perf_counter() - start
+
+
+def shared_lookups_dir() -> str:
+    """Shared lookups directory with the continents table written (if
+    found), None if TASKS shared_lookups_path is not set"""
+    from activefire.firedata import prepare
+
+    cfg = config.config_dict
+    if not cfg["TASKS"]["shared_lookups_path"]:
+        return None
+    lookup_dir = Path(cfg["OS"]["data_path"], cfg["TASKS"]["shared_lookups_path"])
+    lookup_dir.mkdir(parents=True, exist_ok=True)
+    continents_path = Path(cfg["OS"]["admin_data_path"], "countries_continents.parquet")
+    if continents_path.exists():
+        prepare.write_shared_continents(str(lookup_dir), continents_path)
+    return str(lookup_dir)
+
+
+def init_worker(config_dict: dict, lookup_dir: str):
+    """Process pool initializer: the configuration of the parent
+    process and its shared lookups directory"""
+    config.install(config_dict)
+    if lookup_dir is not None:
+        from activefire.firedata import prepare
+
+        prepare.share_lookups(lookup_dir)
+
+
+def run_all(sensors: list[str] = None) -> int:
+    """Run the nrt pipeline of all sensors (TASKS nrt_sensors if not
+    given) concurrently. A failing sensor does not stop the others.
+    Returns the exit status, 1 if any sensor failed, 0 otherwise."""
+    if sensors is None:
+        sensors = config.config_dict["TASKS"]["nrt_sensors"]
+    if not sensors:
+        print("No nrt sensors to update")
+        return 0
+    failed = []
+    mp_context = multiprocessing.get_context("spawn")
+    # workers use the configuration of this process, not the file
+    pool = concurrent.futures.ProcessPoolExecutor(
+        len(sensors),
+        mp_context,
+        initializer=init_worker,
+        initargs=(config.config_dict, shared_lookups_dir()),
+    )
+    with pool:
+        futures = {pool.submit(run_sensor, x): x for x in sensors}
+        for future in concurrent.futures.as_completed(futures):
+            sensor = futures[future]
+            try:
+                _, new_data, seconds = future.result()
+            except Exception as exc:
+                logger.error("%s nrt update failed", sensor, exc_info=exc)
+                failed.append(sensor)
+            else:
+                print(f"{sensor} new data: {new_data}, {seconds:.1f} s")
+    if failed:
+        logger.error("nrt update failed for %s", ", ".join(sorted(failed)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fetch, transform and load nrt data of sensors concurrently"
+    )
+    parser.add_argument(
+        "sensors", nargs="*", help="sensor names, TASKS nrt_sensors if not given"
+    )
+    args = parser.parse_args()
+    sys.exit(run_all(args.sensors or None))
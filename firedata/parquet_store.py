@@ -0,0 +1,245 @@
+"""
+Parquet storage backend for fire detections and events. Records
+are written to hive-partitioned (sensor/year/month) parquet datasets
+with zstd compression and row group statistics, and read with
+predicate and projection pushdown.
+"""
+import uuid
+import hashlib
+from pathlib import Path
+
+import pandas as pd
+
+from activefire import config
+from activefire.firedata._utils import sql_datatypes
+
+_operators = {
+    "==": "=",
+    "!=": "!=",
+    "<": "<",
+    "<=": "<=",
+    ">": ">",
+    ">=": ">=",
+}
+
+
+def filters_to_sql(filters: list[tuple]):
+    """Translate a conjunction of (column, op, value) filters into
+    a sql where clause with ? placeholders and a list of params"""
+    clauses = []
+    params = []
+    for column, op, value in filters:
+        if op == "in":
+            clauses.append(f"{column} IN ({', '.join(['?'] * len(value))})")
+            params.extend(value)
+        else:
+            clauses.append(f"{column} {_operators[op]} ?")
+            params.append(value)
+    return " AND ".join(clauses), params
+
+
+def filters_to_expression(filters: list[tuple]):
+    """Translate a conjunction of (column, op, value) filters into
+    a pyarrow dataset expression"""
+    import pyarrow.dataset as ds
+
+    expression = None
+    for column, op, value in filters:
+        field = ds.field(column)
+        if op == "in":
+            expr = field.isin(list(value))
+        elif op == "==":
+            expr = field == value
+        elif op == "!=":
+            expr = field != value
+        elif op == "<":
+            expr = field < value
+        elif op == "<=":
+            expr = field <= value
+        elif op == ">":
+            expr = field > value
+        elif op == ">=":
+            expr = field >= value
+        else:
+            raise ValueError(f"Unsupported filter operator {op}")
+        expression = expr if expression is None else expression & expr
+    return expression
+
+
+def time_range_filters(time_range: tuple, start_col="date", end_col="date"):
+    """Filters selecting records within time_range (start, end). The
+    year partition filter lets pyarrow skip whole directories."""
+    start_date, end_date = [pd.Timestamp(x) for x in time_range]
+    return [
+        ("year", ">=", start_date.year),
+        ("year", "<=", end_date.year),
+        (end_col, ">=", int(start_date.timestamp())),
+        (start_col, "<=", int(end_date.timestamp())),
+    ]
+
+
+class ParquetStore(object):
+    """Hive-partitioned parquet store of extinct detections and events
+    of a sensor. Mirrors the DataBase insert/query interface.
+    """
+
+    partitioning = ["sensor", "year", "month"]
+
+    def __init__(self, sensor: str):
+        self.sensor = sensor
+        cfg = config.config_dict["DATABASE"]
+        self.root = Path(config.config_dict["OS"]["data_path"], cfg["parquet_path"])
+        self.compression = cfg["parquet_compression"]
+        self.row_group_size = cfg["parquet_row_group_size"]
+        self.compact_min_rows = cfg["parquet_compact_min_rows"]
+
+    def table_path(self, table: str) -> Path:
+        return Path(self.root, table)
+
+    def write(self, dataset: pd.DataFrame, table: str, date_col: str, dtypes: dict):
+        """Append dataset to the table dataset partitioned by sensor
+        and year/month of date_col"""
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        if len(dataset) == 0:
+            return
+        dataset = dataset[list(dtypes.keys())].astype(dtypes)
+        dates = pd.to_datetime(dataset[date_col], unit="s")
+        dataset = dataset.assign(
+            sensor=self.sensor, year=dates.dt.year.values, month=dates.dt.month.values
+        )
+        dataset = dataset.sort_values(date_col)
+        # file names derived from the content: writing the same dataset
+        # again (a repeated, interrupted, load) overwrites its files
+        digest = hashlib.sha1(
+            pd.util.hash_pandas_object(dataset, index=False).values.tobytes()
+        ).hexdigest()[:16]
+        table_pa = pa.Table.from_pandas(dataset, preserve_index=False)
+        file_options = ds.ParquetFileFormat().make_write_options(
+            compression=self.compression, write_statistics=True
+        )
+        ds.write_dataset(
+            table_pa,
+            self.table_path(table),
+            format="parquet",
+            partitioning=self.partitioning,
+            partitioning_flavor="hive",
+            basename_template=f"part-{digest}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            file_options=file_options,
+            max_rows_per_group=self.row_group_size,
+        )
+
+    def insert_extinct(self, dataset: pd.DataFrame):
+        self.write(
+            dataset, "detections", "date", sql_datatypes["SQL_detections_dtypes"]
+        )
+
+    def insert_events(self, dataset: pd.DataFrame):
+        """Store extinct events. Active events change with every
+        update and are kept in the sqlite database only."""
+        if "active" in dataset:
+            dataset = dataset[dataset.active == 0]
+        self.write(dataset, "events", "start_date", sql_datatypes["SQL_events_dtypes"])
+
+    def dataset(self, table: str):
+        import pyarrow.dataset as ds
+
+        path = self.table_path(table)
+        if not path.exists():
+            return None
+        return ds.dataset(path, format="parquet", partitioning="hive")
+
+    def iter_batches(
+        self,
+        table: str = "detections",
+        columns: list[str] = None,
+        filters: list[tuple] = None,
+        time_range: tuple = None,
+        chunk_size: int = None,
+    ):
+        """Generator of DataFrame chunks of the table. Only columns are
+        read and filters / time_range are pushed down to partition
+        pruning and row group statistics."""
+        dataset = self.dataset(table)
+        if dataset is None:
+            return
+        filters = [("sensor", "==", self.sensor)] + list(filters or [])
+        if time_range is not None:
+            if table == "events":
+                filters += time_range_filters(time_range, "start_date", "last_date")
+                # events are partitioned by start_date only
+                filters = [f for f in filters if f[0:2] != ("year", ">=")]
+            else:
+                filters += time_range_filters(time_range)
+        dtypes = (
+            sql_datatypes["SQL_events_dtypes"]
+            if table == "events"
+            else sql_datatypes["SQL_detections_dtypes"]
+        )
+        if columns is None:
+            columns = list(dtypes.keys())
+        scanner = dataset.scanner(
+            columns=columns,
+            filter=filters_to_expression(filters),
+            batch_size=chunk_size or config.config_dict["DATABASE"]["query_chunk_size"],
+        )
+        for batch in scanner.to_batches():
+            if batch.num_rows == 0:
+                continue
+            chunk = batch.to_pandas()
+            yield chunk.astype({k: v for k, v in dtypes.items() if k in chunk})
+
+    def read(self, table: str = "detections", **kwargs) -> pd.DataFrame:
+        """Read the table into a DataFrame, see iter_batches"""
+        chunks = list(self.iter_batches(table, **kwargs))
+        if len(chunks) == 0:
+            return pd.DataFrame()
+        return pd.concat(chunks).reset_index(drop=True)
+
+    def max_id(self):
+        """Max detection id, from row group statistics only"""
+        import pyarrow.parquet as pq
+
+        max_id = None
+        path = Path(self.table_path("detections"), f"sensor={self.sensor}")
+        for file_name in path.glob("year=*/month=*/*.parquet"):
+            metadata = pq.ParquetFile(file_name).metadata
+            id_index = metadata.schema.names.index("id")
+            for rg in range(metadata.num_row_groups):
+                stats = metadata.row_group(rg).column(id_index).statistics
+                if stats is not None and stats.has_min_max:
+                    max_id = stats.max if max_id is None else max(max_id, stats.max)
+        return max_id
+
+    def compact(self, table: str = "detections"):
+        """Merge small parquet files (as written by frequent nrt
+        updates) within each sensor/year/month partition into a
+        single date sorted file."""
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+
+        path = Path(self.table_path(table), f"sensor={self.sensor}")
+        sort_col = "start_date" if table == "events" else "date"
+        for partition in sorted(path.glob("year=*/month=*")):
+            file_names = sorted(partition.glob("*.parquet"))
+            if len(file_names) < 2:
+                continue
+            rows = [pq.ParquetFile(x).metadata.num_rows for x in file_names]
+            small = [x for x, n in zip(file_names, rows) if n < self.compact_min_rows]
+            if len(small) < 2:
+                continue
+            print(f"compacting {len(small)} files in {partition}")
+            merged = ds.dataset(small, format="parquet").to_table()
+            merged = merged.sort_by(sort_col)
+            out_name = Path(partition, f"part-{uuid.uuid4().hex}-c.parquet")
+            pq.write_table(
+                merged,
+                out_name,
+                compression=self.compression,
+                row_group_size=self.row_group_size,
+                write_statistics=True,
+            )
+            for file_name in small:
+                file_name.unlink()
@@ -5,7 +5,13 @@ tadasnik tadas.nik@gmail.com
 """
 import os
 import glob
-import time
+import queue
+import shutil
+import tempfile
+import threading
+import collections
+import multiprocessing
+import concurrent.futures
 
 import numpy as np
 import pandas as pd
@@ -15,9 +21,33 @@ from pathlib import Path
 from .. import config
 from activefire.firedata import fetch
 from activefire.firedata import database
+from activefire.firedata import analytics
+from activefire.firedata import journal
+from activefire.firedata import metrics
+from activefire.firedata.profiling import profiled
 from activefire.firedata import prepare
 from activefire.firedata import _utils
-from activefire.cluster import split_dbscan
+from activefire.firedata._utils import FireDate, sql_datatypes, detection_keys
+from activefire.firedata._utils import bytes_per_detection
+
+
+def enrich_archive_file(sensor: str, file_name: str, out_dir: str) -> tuple:
+    """Process pool worker: reads archive file_name in date ordered
+    batches, enriches them (prepare_detections_dataset) and writes each to
+    an Arrow IPC file in out_dir. Returns the IPC file names in date order
+    and the stage metrics of the worker (see metrics.Metrics.take).
+    """
+    import pyarrow.feather as feather
+
+    proc = ProcSQL(sensor)
+    stem = Path(file_name).stem
+    out_names = []
+    for nr, batch in enumerate(proc.archive_batches(file_name)):
+        batch = proc.prepare_detections_dataset(batch)
+        out_name = str(Path(out_dir, f"{stem}_{nr:05d}.arrow"))
+        feather.write_feather(batch, out_name, compression="uncompressed")
+        out_names.append(out_name)
+    return out_names, metrics.recorder(sensor).take()
 
 
 class ProcSQL(prepare.PrepData):
@@ -26,38 +56,71 @@ class ProcSQL(prepare.PrepData):
         self.eps = self.config["CLUSTER"]["eps"]
         self.min_samples = self.config["CLUSTER"]["min_samples"]
         self.chunk_size = self.config["CLUSTER"]["chunk_size"]
+        self.pipeline = self.config["CLUSTER"]["pipeline"]
+        self.incremental_events = self.config["CLUSTER"]["incremental_events"]
         self.sensor = sensor
         self.db = database.DataBase(sensor)
+        self.analytics = analytics.AnalyticsEngine(self.db)
+        # clustering frontier (active detections) kept by long running
+        # processes, see active_detections
+        self.keep_frontier = False
+        self._frontier = None
+        self._frontier_id = None
+        self._fetcher = None
 
-    def get_nrt(self):
-        """Faetches near-real time active fire data from FIRMS. The data
-        is fetched for each day (inclusive) between the last day of
-        data stored in the database and current day."""
-        nrt_file_name = Path(self.config["OS"]["data_path"], self.config["TASKS"]["fetch_nrt_data"])
-        base_url = self.config[self.sensor]["base_url"]
-        fetcher = fetch.FetchNRT(self.sensor, self.config["nrt_token"], base_url)
-        start_date = pd.Timestamp(self.last_date(), tz="utc")
+    def staged_file_names(self):
+        """Paths of the files passing data between the nrt
+        fetch, transform and load stages, prefixed with the sensor
+        name so sensors can run concurrently"""
+        data_path = self.config["OS"]["data_path"]
+        tasks = self.config["TASKS"]
+        return (
+            Path(data_path, f"{self.sensor}_{tasks['fetch_nrt_data']}"),
+            Path(data_path, f"{self.sensor}_{tasks['transformed_detections_nrt_data']}"),
+            Path(data_path, f"{self.sensor}_{tasks['transformed_events_nrt_data']}"),
+        )
+
+    @profiled("fetch_nrt")
+    def fetch_nrt(self):
+        """Fetches near-real time active fire data from FIRMS and
+        prepares the detections dataset. The data is fetched for each
+        day (inclusive) between the last day of data stored in the
+        database and current day. Returns None if there is no new data."""
+        if self._fetcher is None:
+            base_url = self.config[self.sensor]["base_url"]
+            self._fetcher = fetch.FetchNRT(
+                self.sensor, self.config["nrt_token"], base_url
+            )
+        fetcher = self._fetcher
+        last_date = self.last_date()
+        if last_date is None:
+            raise ValueError(
+                f"No active detections in the {self.sensor} database, "
+                "populate it from the archive (populate_archive) first"
+            )
+        start_date = pd.Timestamp(last_date, tz="utc")
         end_date = pd.Timestamp.utcnow()
         dfr = fetcher.fetch(start_date, end_date)
+        if dfr is None:
+            return None
+        if self.firms_dtypes() is not None:
+            dfr = dfr.astype(self.firms_dtypes(dfr))
+        dfr = self.drop_known(dfr)
+        if len(dfr) == 0:
+            return None
         dfr = self.prepare_detections_dataset(dfr)
         new_data = self.new_data_check(dfr)
         print("new_data_check: ", new_data)
-        if dfr is not None:
-            dfr = dfr.reset_index(drop=True)
-        if len(dfr)>0 and new_data:
-            print("fetch - writing nrt data to file")
-            dfr.to_parquet(nrt_file_name)
-            return True
-        else:
-            return False
+        dfr = dfr.reset_index(drop=True)
+        if len(dfr) > 0 and new_data:
+            return dfr
+        return None
 
-    def transform_nrt(self):
-        """Prepares near-real time active fire data from FIRMS. A wrapper
-        around prepare_detections_dataset and cluster routines"""
-        raw_nrt_file_name = Path(self.config["OS"]["data_path"], self.config["TASKS"]["fetch_nrt_data"])
-        transformed_detections_file_name = Path(self.config["OS"]["data_path"], self.config["TASKS"]["transformed_detections_nrt_data"])
-        transformed_events_file_name = Path(self.config["OS"]["data_path"], self.config["TASKS"]["transformed_events_nrt_data"])
-        dataset = pd.read_parquet(raw_nrt_file_name)
+    @profiled("transform")
+    def transform(self, dataset: pd.DataFrame):
+        """Clusters the fetched detections (dataset) together with the active
+        detections in the database. Returns the detections and events datasets
+        """
         self.consistency_check(dataset)
         dataset = self.increment_index(dataset)
 
@@ -65,60 +128,431 @@ class ProcSQL(prepare.PrepData):
         min_date_active = pd.to_datetime(active.date.min(), unit="s")
         max_date_active = pd.to_datetime(active.date.max(), unit="s")
         print("active shape: ", active.shape, min_date_active, max_date_active)
+        return self.cluster_chunk(dataset, active)
+
+    def cluster_chunk(self, dataset: pd.DataFrame, active: pd.DataFrame):
+        """Clusters new detections (dataset, with ids assigned) together
+        with the active detections. Returns the detections and events datasets
+        """
         dataset = pd.concat([active, dataset])
-        # drop duplicates
+        print(f"working set {bytes_per_detection(dataset):.1f} bytes per detection")
+        # drop exact duplicates, detections already stored in earlier
+        # runs are dropped by drop_known
         dataset = dataset.drop_duplicates(subset=["longitude", "latitude", "date"])
         # cluster new chunk and active
         event, active_flag = self.cluster_dataframe(dataset)
         dataset["event"] = event.astype(int)
         # Try to preserve past event labels
         dataset["event"] = self.event_ids(dataset)
-        dataset["active"] = active_flag.astype(int)
+        compact = self.config["DATABASE"]["compact_dtypes"]
+        dataset["active"] = active_flag.astype("int8" if compact else int)
 
-        events_dataset = self.prepare_event_dataset(dataset)
+        if self.incremental_events:
+            touched = self.touched_events(dataset, active)
+            events_dataset = self.prepare_event_dataset(
+                dataset[dataset.event.isin(touched)]
+            )
+        else:
+            events_dataset = self.prepare_event_dataset(dataset)
+        return dataset, events_dataset
 
-        max_date_dfr = pd.to_datetime(dataset.date.max(), unit="s")
-        print("writing transformed detections max date : ", max_date_dfr)
-        dataset.to_parquet(transformed_detections_file_name)
-        events_dataset.to_parquet(transformed_events_file_name)
+    def touched_events(self, dataset: pd.DataFrame, active: pd.DataFrame):
+        """Labels of the events in the clustered dataset whose detections
+        changed: events with new detections, with detections relabelled
+        (merged or split events) or which became extinct. The remaining
+        events hold the same detections as before and their rows in the
+        events table stay valid.
+        """
+        merged = pd.merge(
+            dataset[["id", "event", "active"]],
+            active[["id", "event"]],
+            on="id",
+            how="left",
+            suffixes=("", "_prev"),
+        )
+        changed = (
+            merged.event_prev.isna()
+            | (merged.event != merged.event_prev)
+            | (merged.active == 0)
+        )
+        # previous labels too, events which lost detections to a split
+        previous = merged.loc[changed, "event_prev"].dropna().astype(int)
+        return np.union1d(merged.loc[changed, "event"].unique(), previous.unique())
 
-    def load_nrt(self):
-        """Loads transformed near-real FIRMS fire data to the database. A wrapper
-        around self.populate_db"""
-        transformed_detections_file_name = Path(self.config["OS"]["data_path"], self.config["TASKS"]["transformed_detections_nrt_data"])
-        transformed_events_file_name = Path(self.config["OS"]["data_path"], self.config["TASKS"]["transformed_events_nrt_data"])
-        dataset = pd.read_parquet(transformed_detections_file_name)
+    def stale_events(self, dataset: pd.DataFrame, events_dataset: pd.DataFrame):
+        """Active events in the database which are to be replaced by
+        events_dataset or no longer exist in the clustered dataset"""
+        db_active = self.db.return_many_values(
+            "SELECT event FROM events WHERE active = 1"
+        ).event
+        stale = ~db_active.isin(dataset.event) | db_active.isin(events_dataset.event)
+        return db_active[stale].tolist()
+
+    @profiled("load")
+    def load(
+        self,
+        dataset: pd.DataFrame,
+        events_dataset: pd.DataFrame,
+        run_journal: journal.RunJournal = None,
+    ):
+        """Loads transformed detections and events datasets to the database.
+        With run_journal each completed step is recorded and steps
+        recorded by a previous, failed, load of the same datasets are
+        skipped. A step which failed partway is run again, the steps
+        replace the rows they may have written already."""
         max_date_dfr = pd.to_datetime(dataset.date.max(), unit="s")
         min_date_dfr = pd.to_datetime(dataset.date.min(), unit="s")
-        print("load reading transformed detections max date : ", dataset.shape, max_date_dfr)
-        print("load reading transformed detections min date : ", dataset.shape, min_date_dfr)
-        events_dataset = pd.read_parquet(transformed_events_file_name)
-        # delete active detections from the database
-        self.delete_active()
-
-        print("last date in db before insert: ", pd.Timestamp(self.last_date(), tz="utc"))
-        self.db.insert_events(events_dataset)
-        self.db.insert_active(dataset[dataset.active == 1])
-        self.db.insert_extinct(dataset[dataset.active == 0])
+        print("load transformed detections max date : ", dataset.shape, max_date_dfr)
+        print("load transformed detections min date : ", dataset.shape, min_date_dfr)
+        # the frontier is invalid until the load succeeds
+        self._frontier = None
+
+        def delete():
+            # delete active detections from the database
+            if self.incremental_events:
+                # events_dataset holds the touched events only
+                stale = self.stale_events(dataset, events_dataset)
+                self.delete_active(events=False)
+                print(f"replacing {len(stale)} active events")
+                self.db.delete_events(stale)
+            else:
+                self.delete_active()
+            print(
+                "last date in db before insert: ",
+                pd.Timestamp(self.last_date(), tz="utc"),
+            )
+
+        def ranking():
+            if self.incremental_events:
+                self.update_ranking(
+                    self.db.return_many_values(
+                        """SELECT event, active, continent, tot_size
+                        FROM events WHERE active = 1"""
+                    )
+                )
+            else:
+                self.update_ranking(events_dataset)
+
+        active = dataset[dataset.active == 1]
+        extinct = dataset[dataset.active == 0]
+        # (journal step, metrics stage, rows, step)
+        steps = [
+            ("delete_active", "delete", None, delete),
+            ("insert_events", "insert", len(events_dataset),
+             lambda: self.db.insert_events(events_dataset)),
+            ("insert_active", "insert", len(active), lambda: self.db.insert_active(active)),
+            ("insert_extinct", "insert", len(extinct), lambda: self.db.insert_extinct(extinct)),
+            ("insert_keys", "insert_keys", len(dataset), lambda: self.db.insert_keys(dataset)),
+            ("finalise", "finalise_partitions", None,
+             lambda: self.db.finalise_closed_partitions(active.date.min())),
+            ("update_ranking", "ranking", None, ranking),
+            ("update_rollups", "rollups", len(extinct), lambda: self.update_rollups(extinct)),
+        ]
+        for name, stage, rows, step in steps:
+            if run_journal is not None and name in run_journal.steps:
+                print(f"load step {name} done by a previous run, skipping")
+                continue
+            with metrics.stage(self.sensor, stage, rows) as rec:
+                step()
+                rec["rows_out"] = rows
+            if run_journal is not None:
+                run_journal.step_done(name)
+        if self.keep_frontier:
+            self._frontier = self.stored_active(dataset)
+            self._frontier_id = dataset.id.max()
         print("last date in db after insert: ", pd.Timestamp(self.last_date(), tz="utc"))
 
+    @profiled("get_nrt")
+    def get_nrt(self):
+        """Fetch stage of the nrt pipeline, writes the fetched
+        dataset to file. Returns True if there is new data."""
+        nrt_file_name, _, _ = self.staged_file_names()
+        dfr = self.fetch_nrt()
+        if dfr is None:
+            return False
+        print("fetch - writing nrt data to file")
+        dfr.to_parquet(nrt_file_name)
+        self.run_journal().complete("fetched", [nrt_file_name])
+        return True
+
+    @profiled("transform_nrt")
+    def transform_nrt(self):
+        """Transform stage of the nrt pipeline, reads fetched
+        data and writes the transformed datasets to files"""
+        raw_nrt_file_name, detections_file_name, events_file_name = self.staged_file_names()
+        dataset = pd.read_parquet(raw_nrt_file_name)
+        dataset, events_dataset = self.transform(dataset)
+        max_date_dfr = pd.to_datetime(dataset.date.max(), unit="s")
+        print("writing transformed detections max date : ", max_date_dfr)
+        dataset.to_parquet(detections_file_name)
+        events_dataset.to_parquet(events_file_name)
+        self.run_journal().complete(
+            "transformed", [detections_file_name, events_file_name]
+        )
+
+    @profiled("load_nrt")
+    def load_nrt(self):
+        """Load stage of the nrt pipeline, loads the transformed
+        datasets to the database and removes the files. Resumes a
+        previously failed load of the same files."""
+        _, detections_file_name, events_file_name = self.staged_file_names()
+        dataset = pd.read_parquet(detections_file_name)
+        events_dataset = pd.read_parquet(events_file_name)
+        run_journal = self.run_journal()
+        self.load(dataset, events_dataset, run_journal)
+        run_journal.complete("loaded")
         # remove transformed datasets
-        transformed_detections_file_name.unlink()
-        transformed_events_file_name.unlink()
+        detections_file_name.unlink()
+        events_file_name.unlink()
+
+    def run_journal(self):
+        """Journal of the checkpointed nrt runs of the sensor"""
+        data_path = self.config["OS"]["data_path"]
+        return journal.RunJournal(Path(data_path, f"{self.sensor}_nrt_journal.json"))
+
+    def resume_stage(self):
+        """Last completed stage of an unfinished checkpointed run
+        (fetched or transformed), None if the run finished or its
+        staged files have changed since"""
+        run_journal = self.run_journal()
+        if run_journal.stage not in ("fetched", "transformed"):
+            return None
+        if not run_journal.verify():
+            print(f"staged files of {run_journal.stage} stage changed, starting over")
+            return None
+        print(f"resuming nrt run after {run_journal.stage} stage")
+        return run_journal.stage
+
+    def run_nrt(self, checkpoint: bool = None):
+        """Runs the fetch, transform and load nrt pipeline. The
+        datasets are passed between the stages in memory, unless
+        checkpoint (TASKS checkpoint if not given) is enabled, in which
+        case the staged files are written and read by each stage and a
+        run interrupted by a failure is resumed after its last completed
+        stage (see run_journal). Returns True if new data was loaded."""
+        if checkpoint is None:
+            checkpoint = self.config["TASKS"]["checkpoint"]
+        try:
+            if checkpoint:
+                stage = self.resume_stage()
+                if stage is None:
+                    if not self.get_nrt():
+                        return False
+                    stage = "fetched"
+                if stage == "fetched":
+                    self.transform_nrt()
+                self.load_nrt()
+                return True
+            dataset = self.fetch_nrt()
+            if dataset is None:
+                return False
+            dataset, events_dataset = self.transform(dataset)
+            self.load(dataset, events_dataset)
+            return True
+        finally:
+            metrics.flush(self.sensor)
+
+    def update_ranking(self, events: pd.DataFrame):
+        """Update the size ranking of active events (active_ranking table).
+        events must hold all active events, as after delete_active
+        and insert. Only the rows of events that became extinct (or
+        were merged) and events with changed size are touched.
+        """
+        self.db.execute_sql(self.config["SQL"]["sql_create_ranking_table"])
+        self.db.execute_sql(self.config["SQL"]["sql_create_ranking_index"])
+        ranking = self.db.return_many_values(
+            "SELECT event, continent, tot_size FROM active_ranking"
+        )
+        active = events.loc[events.active == 1, ["event", "continent", "tot_size"]]
+        merged = pd.merge(
+            ranking, active, on="event", how="outer", suffixes=("_old", ""),
+            indicator=True
+        )
+        removed = merged.loc[merged._merge == "left_only", "event"]
+        changed = merged[
+            (merged._merge == "right_only")
+            | (
+                (merged._merge == "both")
+                & (
+                    (merged.tot_size != merged.tot_size_old)
+                    | (merged.continent.fillna("") != merged.continent_old.fillna(""))
+                )
+            )
+        ]
+        with self.db.create_connection() as conn:
+            cur = conn.cursor()
+            cur.executemany(
+                "DELETE FROM active_ranking WHERE event = ?",
+                [(int(x),) for x in removed],
+            )
+            cur.executemany(
+                "INSERT OR REPLACE INTO active_ranking VALUES (?, ?, ?)",
+                [
+                    (int(ev), cont if isinstance(cont, str) else None, int(size))
+                    for ev, cont, size in changed[["event", "continent", "tot_size"]].values
+                ],
+            )
+            conn.commit()
+        print(f"ranking: {len(removed)} removed, {len(changed)} updated")
+
+    def rebuild_ranking(self):
+        """Build the active_ranking table from the active events, for
+        databases loaded before the ranking was maintained"""
+        print("building active events ranking")
+        events = self.db.return_many_values(
+            "SELECT event, active, continent, tot_size FROM events WHERE active = 1"
+        )
+        self.update_ranking(events)
+
+    def top_events(self, continent: str, n: int = 50) -> pd.DataFrame:
+        """Return n largest (tot_size) active events in the continent
+        from the active_ranking table, built first if missing"""
+        if not self.db.table_exists("active_ranking"):
+            self.rebuild_ranking()
+        sql_string = """SELECT e.* FROM active_ranking r
+            JOIN events e ON e.event = r.event
+            WHERE r.continent = ?
+            ORDER BY r.tot_size DESC LIMIT ?"""
+        return self.db.return_many_values(sql_string, (continent, n))
+
+    @staticmethod
+    def daily_aggregate(detections: pd.DataFrame) -> pd.DataFrame:
+        """Aggregate detections per day, admin and lc: count,
+        summed frp, day and night counts"""
+        dfr = pd.DataFrame(
+            {
+                "day": detections.date.values // 86400,
+                "admin": detections.admin.values,
+                "lc": detections.lc.values,
+                "frp": detections.frp.values.astype(float),
+                "count_day": (detections.daynight.values == 1).astype(int),
+            }
+        )
+        dfr = dfr.groupby(["day", "admin", "lc"]).agg(
+            count=("frp", "size"), frp=("frp", "sum"), count_day=("count_day", "sum")
+        )
+        dfr["count_night"] = dfr["count"] - dfr["count_day"]
+        return dfr.reset_index()
+
+    def update_rollups(self, detections: pd.DataFrame):
+        """Fold newly inserted extinct detections into the daily_rollup
+        table. Active detections are not included as these are
+        re-inserted with every update, rollup_series adds them.
+        Detections already folded in (by a repeated, interrupted, load)
+        are not counted again, see rollup_loads."""
+        self.db.execute_sql(self.config["SQL"]["sql_create_rollup_table"])
+        self.db.execute_sql(self.config["SQL"]["sql_create_rollup_loads_table"])
+        if len(detections) == 0:
+            return
+        rollup = self.daily_aggregate(detections)
+        columns = ["day", "admin", "lc", "count", "frp", "count_day", "count_night"]
+        sql_string = """INSERT INTO daily_rollup VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(day, admin, lc) DO UPDATE SET
+            count = count + excluded.count,
+            frp = frp + excluded.frp,
+            count_day = count_day + excluded.count_day,
+            count_night = count_night + excluded.count_night"""
+        # a detection becomes extinct once, its id identifies the load,
+        # recorded in the same transaction as the rollup update
+        load_key = int(detections.id.max())
+        with self.db.create_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("INSERT OR IGNORE INTO rollup_loads VALUES (?)", (load_key,))
+            if cur.rowcount == 0:
+                print("detections already in daily_rollup, skipping")
+                return
+            cur.executemany(sql_string, rollup[columns].values.tolist())
+            conn.commit()
+
+    def rebuild_rollups(self):
+        """Rebuild daily_rollup table from all extinct detections,
+        e.g. after archive backfill"""
+        self.db.execute_sql(self.config["SQL"]["sql_create_rollup_table"])
+        self.db.execute_sql(self.config["SQL"]["sql_create_rollup_loads_table"])
+        self.db.run_sql("DELETE FROM daily_rollup")
+        self.db.run_sql("DELETE FROM rollup_loads")
+        columns = ["id", "date", "admin", "lc", "frp", "daynight"]
+        for nr, chunk in enumerate(self.db.extinct_chunks(columns)):
+            print(f"rollup chunk {nr}", chunk.shape)
+            self.update_rollups(chunk)
+
+    def rollup_series(
+        self,
+        by: str = "admin",
+        values: list[int] = None,
+        time_range: tuple = None,
+        include_active: bool = True,
+    ) -> pd.DataFrame:
+        """Daily time series of detection counts, frp and day/night
+        counts per country (by='admin') or land cover (by='lc') from
+        the rollup table, optionally for the given values only.
+        Active detections (not yet in the rollup) are added if
+        include_active."""
+        assert by in ["admin", "lc"], "by must be 'admin' or 'lc'"
+        self.db.execute_sql(self.config["SQL"]["sql_create_rollup_table"])
+        where = []
+        params = []
+        if values is not None:
+            where.append(f"{by} IN ({', '.join(['?'] * len(values))})")
+            params += [int(x) for x in values]
+        if time_range is not None:
+            start_date, end_date = [
+                int(pd.Timestamp(x).timestamp()) for x in time_range
+            ]
+            where.append("day >= ? AND day <= ?")
+            params += [start_date // 86400, end_date // 86400]
+        sql_string = f"""SELECT day, {by}, sum(count) AS count, sum(frp) AS frp,
+            sum(count_day) AS count_day, sum(count_night) AS count_night
+            FROM daily_rollup"""
+        if where:
+            sql_string += " WHERE " + " AND ".join(where)
+        sql_string += f" GROUP BY day, {by}"
+        series = self.db.return_many_values(sql_string, params)
+        if include_active:
+            active = self.daily_aggregate(self.active_detections())
+            if values is not None:
+                active = active[active[by].isin(values)]
+            if time_range is not None:
+                active = active[
+                    (active.day >= params[-2]) & (active.day <= params[-1])
+                ]
+            series = pd.concat([series, active[series.columns]])
+        series = series.groupby(["day", by]).sum().reset_index()
+        series["date"] = pd.to_datetime(series.day * 86400, unit="s")
+        return series
+
+    def analytics_query(self, sql_string: str, params=None, arrow: bool = False):
+        """Run a reporting query (sqlite dialect compatible SQL over
+        events, detections_active and detections_extinct) with the
+        DuckDB analytics engine. Returns DataFrame or pyarrow Table."""
+        return self.analytics.query(sql_string, params, arrow)
+
+    def compact_storage(self):
+        """Merge small parquet files of the parquet storage backend"""
+        if self.db.store is None:
+            print("storage backend is not parquet, nothing to compact")
+            return
+        self.db.store.compact("detections")
+        self.db.store.compact("events")
 
     def cluster_dataframe(self, dfr: pd.DataFrame):
         """Convenience method to cluster dataset passed as pandas DataFrame (dfr).
         Must contain longitude, latitude and date columns. Date is assumed to
         be unixepoch.
         """
-        indx, indy = _utils.ModisGrid.modis_sinusoidal_grid_index(
-            dfr.longitude, dfr.latitude
-        )
-        day_since = (dfr.date / 86400).astype(int)
-        ars = np.column_stack([day_since, indx, indy])
-        cl = split_dbscan.SplitDBSCAN(eps=self.eps, min_samples=self.min_samples)
-        cl.fit(ars)
-        active_mask = cl.split(ars)
+        # sklearn is imported on first clustering
+        from activefire.cluster import split_dbscan
+
+        with metrics.stage(self.sensor, "clustering", len(dfr)) as rec:
+            indx, indy = _utils.ModisGrid.modis_sinusoidal_grid_index(
+                dfr.longitude, dfr.latitude
+            )
+            day_since = (dfr.date / 86400).astype(int)
+            ars = np.column_stack([day_since, indx, indy])
+            cl = split_dbscan.SplitDBSCAN(eps=self.eps, min_samples=self.min_samples)
+            cl.fit(ars)
+            active_mask = cl.split(ars)
+            rec["rows_out"] = len(cl.labels_)
         return cl.labels_.astype(int), active_mask
 
     def event_ids(self, dfr: pd.DataFrame):
@@ -141,14 +575,14 @@ class ProcSQL(prepare.PrepData):
         """Query max id from extinct and active detections.
         Returns only max id of the two.
         """
-        sql_ext = "SELECT max(id) FROM detections_extinct"
         sql_act = "SELECT max(id) FROM detections_active"
-        max_id_ext = self.db.return_single_value(sql_ext)
+        max_id_ext = self.db.max_extinct_id()
         max_id_act = self.db.return_single_value(sql_act)
-        if (max_id_ext is None) and (max_id_act is None):
+        ids = [x for x in [max_id_ext, max_id_act] if x is not None]
+        if len(ids) == 0:
             return 0
         else:
-            max_id = max(max_id_ext, max_id_act)
+            max_id = max(ids)
             return max_id
 
     def last_date(self):
@@ -158,18 +592,44 @@ class ProcSQL(prepare.PrepData):
         max_date = self.db.return_single_value(sql_string)
         return max_date
 
+    def stored_active(self, dataset: pd.DataFrame):
+        """Active detections of the clustered dataset as if read
+        back from the database (see active_detections)"""
+        active = dataset.loc[
+            dataset.active == 1, list(sql_datatypes["SQL_detections_dtypes"])
+        ]
+        if self.config["DATABASE"]["compact_dtypes"]:
+            active = self.columns_dtypes(active, "SQL_detections_dtypes")
+        else:
+            active = active.astype(
+                {col: float if active[col].dtype.kind == "f" else int for col in active}
+            )
+        return active.reset_index(drop=True)
+
     def active_detections(self):
-        """Return all fire records from detections_active as DataFrame"""
+        """Return all fire records from detections_active as DataFrame.
+        With keep_frontier the records loaded last are kept in memory
+        and returned instead of being read from the database, unless
+        another process has loaded data since."""
+        if self._frontier is not None and self.last_id() != self._frontier_id:
+            self._frontier = None
+        if self._frontier is not None:
+            return self._frontier.copy()
         sql_string = """SELECT * FROM detections_active"""
         active = self.db.return_many_values(sql_string)
+        if self.config["DATABASE"]["compact_dtypes"]:
+            active = self.columns_dtypes(active, "SQL_detections_dtypes")
         return active
 
-    def delete_active(self):
-        """Delete active events and delete detections_active table and create an empty one"""
-        print("deleting active events")
-        sql_string = """DELETE FROM events
-                        WHERE events.active = 1"""
-        self.db.execute_sql(sql_string)
+    def delete_active(self, events: bool = True):
+        """Delete active events (unless events is False) and delete
+        detections_active table and create an empty one"""
+        self.db.unindex_active(events)
+        if events:
+            print("deleting active events")
+            sql_string = """DELETE FROM events
+                            WHERE events.active = 1"""
+            self.db.execute_sql(sql_string)
         print("deleting active detections")
         sql_string = "DROP TABLE detections_active"
         self.db.execute_sql(sql_string)
@@ -186,6 +646,30 @@ class ProcSQL(prepare.PrepData):
         dataset["id"] += id_increment
         return dataset
 
+    def drop_known(self, dfr: pd.DataFrame):
+        """Drop detections of the fetched dataset (dfr) which are already
+        in the database, as found in the detection_keys index. Adds
+        the date column if missing, date may be datetime or unix time.
+        Keys match to 0.001 deg and 1 minute, see detection_keys."""
+        if "date" not in dfr:
+            dfr["date"] = FireDate.fire_dates(dfr)
+        dates = dfr["date"]
+        if pd.api.types.is_datetime64_any_dtype(dates):
+            dates = FireDate.unix_time(dates)
+        keys = detection_keys(dfr.longitude, dfr.latitude, dates)
+        known = self.db.known_keys(keys)
+        print(f"dropping {known.sum()} detections already in the database")
+        return dfr[~known]
+
+    def build_detection_keys(self):
+        """Add all stored detections to the detection_keys index,
+        for databases populated before the index was introduced"""
+        columns = ["longitude", "latitude", "date"]
+        for chunk in self.db.extinct_chunks(columns):
+            self.db.insert_keys(chunk)
+        for chunk in self.db.select("detections_active", columns):
+            self.db.insert_keys(chunk)
+
     def new_data_check(self, dfr):
         """Check if dfr contains new data (not yet in database)"""
         max_date_db = pd.Timestamp(self.last_date())
@@ -210,51 +694,353 @@ class ProcSQL(prepare.PrepData):
         print("difference in days", days_dif)
         assert -2 < days_dif < 2, "DataFrame is not consistent with db"
 
+    @profiled("populate_archive")
+    def archive_files(self) -> list[str]:
+        """Archive files of the sensor in date order, the csv files or
+        the year partition files of the archive parquet dataset as set
+        by CLUSTER archive_source"""
+        data_path = self.config["OS"]["data_path"]
+        if self.config["CLUSTER"]["archive_source"] == "parquet":
+            pattern = os.path.join(
+                data_path,
+                self.config["CLUSTER"]["archive_parquet_path"],
+                f"sensor={self.sensor}",
+                "year=*",
+                "*.parquet",
+            )
+        else:
+            pattern = os.path.join(data_path, self.sensor, "fire_archive*.csv")
+        return sorted(glob.glob(pattern))
+
+    def read_archive_file(self, file_name: str) -> pd.DataFrame:
+        """Read archive file_name, a FIRMS csv file or a file of the
+        archive parquet dataset (detections table columns and dtypes)"""
+        if file_name.endswith(".parquet"):
+            return pd.read_parquet(file_name)
+        return pd.read_csv(file_name, dtype=self.firms_dtypes())
+
     def populate_archive(self):
         """Populate database with active fire archive"""
-        archive_dir = os.path.join(
-            self.config["OS"]["data_path"], self.sensor, "fire_archive*.csv"
-        )
-        arch_files = glob.glob(archive_dir)
-        arch_files.sort()
+        arch_files = self.archive_files()
         print(arch_files)
+        if self.config["CLUSTER"]["archive_workers"] != 1:
+            self.populate_archive_parallel(arch_files)
+            return
         for file_name in arch_files:
             print(f"proc file {file_name}")
-            dfr = pd.read_csv(file_name)
+            if self.config["CLUSTER"]["stream_archive"]:
+                self.stream_archive_file(file_name)
+                continue
+            dfr = self.read_archive_file(file_name)
+            if self.pipeline:
+                # enrichment is done by the pipeline, chunk by chunk
+                if "date" not in dfr:
+                    dfr["date"] = FireDate.fire_dates(dfr)
+                dfr = dfr.sort_values(by="date").reset_index(drop=True)
+                self.pipeline_to_db(self.split_chunks(dfr), prepared=False)
+                continue
             dfr = self.prepare_detections_dataset(dfr)
             self.dataframe_to_db(dfr)
 
+    def populate_archive_parallel(self, arch_files: list[str]):
+        """Populate database with archive files enriched in parallel.
+        reading and prepare_detections_dataset run for several files
+        in a process pool (CLUSTER archive_workers, 0 for all cores), the
+        enriched batches are handed over as Arrow IPC files and fed in
+        date order to the single clustering and loading consumer."""
+        import pyarrow.feather as feather
+
+        workers = self.config["CLUSTER"]["archive_workers"] or os.cpu_count()
+        out_dir = tempfile.mkdtemp(prefix="enriched_", dir=self.config["OS"]["data_path"])
+
+        def load_ipc(file_name, future):
+            print(f"loading enriched {file_name}")
+            ipc_names, worker_metrics = future.result()
+            metrics.recorder(self.sensor).merge(worker_metrics)
+            for ipc_name in ipc_names:
+                batch = feather.read_feather(ipc_name)
+                os.remove(ipc_name)
+                yield batch
+
+        def enriched_batches(pool):
+            pending = collections.deque()
+            for file_name in arch_files:
+                future = pool.submit(enrich_archive_file, self.sensor, file_name, out_dir)
+                pending.append((file_name, future))
+                # keep at most two files per worker in flight
+                if len(pending) >= 2 * workers:
+                    yield from load_ipc(*pending.popleft())
+            while pending:
+                yield from load_ipc(*pending.popleft())
+
+        mp_context = multiprocessing.get_context("spawn")
+        # workers use the configuration of this process, not the file
+        pool = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context, initializer=config.install, initargs=(self.config,)
+        )
+        try:
+            batches = enriched_batches(pool)
+            if self.pipeline:
+                self.pipeline_to_db(batches)
+            else:
+                for batch in batches:
+                    self.dataframe_to_db(batch)
+        except BaseException:
+            # do not enrich the remaining files
+            pool.shutdown(cancel_futures=True)
+            raise
+        finally:
+            pool.shutdown()
+            shutil.rmtree(out_dir, ignore_errors=True)
 
+    def archive_pieces(self, file_name: str):
+        """Generator reading archive file_name (csv or parquet, see
+        read_archive_file) in pieces of archive_read_rows rows"""
+        read_rows = self.config["CLUSTER"]["archive_read_rows"]
+        if file_name.endswith(".parquet"):
+            import pyarrow.parquet as pq
+
+            for batch in pq.ParquetFile(file_name).iter_batches(read_rows):
+                yield batch.to_pandas()
+            return
+        pieces = pd.read_csv(file_name, chunksize=read_rows, dtype=self.firms_dtypes())
+        for piece in pieces:
+            piece["date"] = FireDate.fire_dates(piece)
+            yield piece
+
+    @staticmethod
+    def day_starts(dates: pd.Series) -> pd.Series:
+        """Start of the day of dates, datetimes or unix time"""
+        if pd.api.types.is_datetime64_any_dtype(dates):
+            return dates.dt.floor("D")
+        return dates - dates % 86400
+
+    def archive_batches(self, file_name: str):
+        """Generator reading archive file_name in pieces and yielding
+        date sorted batches of whole days with about chunk_size rows
+        (more only if a single day is larger). The file must be ordered
+        by date (days), as the FIRMS archive files are.
+        """
+        buffer = None
+        last_day = None
+        for piece in self.archive_pieces(file_name):
+            days = self.day_starts(piece["date"])
+            if last_day is not None:
+                assert (
+                    days.min() >= last_day
+                ), f"{file_name} is not ordered by date, use stream_archive = false"
+            buffer = piece if buffer is None else pd.concat([buffer, piece])
+            if len(buffer) < self.chunk_size:
+                continue
+            # keep the last (possibly incomplete) day in the buffer
+            last_day = self.day_starts(buffer["date"]).max()
+            complete = buffer["date"] < last_day
+            if complete.any():
+                batch = buffer[complete]
+                buffer = buffer[~complete]
+                yield batch.sort_values(by="date").reset_index(drop=True)
+        if buffer is not None and len(buffer) > 0:
+            yield buffer.sort_values(by="date").reset_index(drop=True)
+
+    def stream_archive_file(self, file_name: str):
+        """Read, enrich and load the archive file_name in bounded
+        batches (see archive_batches), peak memory follows chunk_size"""
+        batches = self.archive_batches(file_name)
+        if self.pipeline:
+            self.pipeline_to_db(batches, prepared=False)
+            return
+        for nr, batch in enumerate(batches):
+            print(f"archive batch {nr}", batch.shape)
+            batch = self.prepare_detections_dataset(batch)
+            self.dataframe_to_db(batch)
+
+    def split_chunks(self, dfr: pd.DataFrame):
+        """Split dfr into chunks of at most chunk_size rows, or on
+        day edges within the memory budget if CLUSTER adaptive_chunks"""
+        if self.config["CLUSTER"]["adaptive_chunks"]:
+            return self.day_edge_chunks(dfr)
+        chunks = -(-len(dfr.index) // self.chunk_size)
+        return np.array_split(dfr, chunks, axis=0)
+
+    @staticmethod
+    def detection_days(dfr: pd.DataFrame) -> np.ndarray:
+        """Days since epoch of the detections, date as datetime or unix time"""
+        if pd.api.types.is_datetime64_any_dtype(dfr.date):
+            return dfr.date.values.astype("datetime64[D]").astype(np.int64)
+        return np.asarray(dfr.date, dtype=np.int64) // 86400
+
+    def day_costs(self, dfr: pd.DataFrame):
+        """Estimated clustering memory (bytes) of each day of detections
+        in dfr. Returns days (days since epoch) and their costs. The
+        DBSCAN neighbourhoods are estimated from the counts of points per
+        eps sized grid cell per day, each point having the points of its
+        cell over eps days on either side as neighbours.
+        """
+        day = self.detection_days(dfr)
+        eps = int(np.ceil(self.eps))
+        indx, indy = _utils.ModisGrid.modis_sinusoidal_grid_index(
+            dfr.longitude, dfr.latitude
+        )
+        cell_x = np.asarray(indx, dtype=np.int64) // eps
+        cell_y = np.asarray(indy, dtype=np.int64) // eps
+        days, day_codes = np.unique(day, return_inverse=True)
+        cells = (day_codes.astype(np.int64) << 40) | (cell_x << 20) | cell_y
+        cells, cell_counts = np.unique(cells, return_counts=True)
+        neighbours = np.bincount(
+            cells >> 40,
+            weights=cell_counts.astype(float) ** 2 * (2 * eps + 1),
+            minlength=len(days),
+        )
+        rows = np.bincount(day_codes, minlength=len(days))
+        row_bytes = self.config["CLUSTER"]["cluster_row_bytes"] + bytes_per_detection(dfr)
+        return days, rows * row_bytes + neighbours * 8
+
+    def day_edge_chunks(self, dfr: pd.DataFrame):
+        """Split date sorted dfr into chunks of whole days, each
+        (estimated, see day_costs) fitting in the CLUSTER memory_budget_mb
+        together with the active detections carried over. A day larger
+        than the budget makes a chunk on its own."""
+        if len(dfr) == 0:
+            return []
+        budget = self.config["CLUSTER"]["memory_budget_mb"] * 2**20
+        days, costs = self.day_costs(dfr)
+        # the last days of a chunk stay active and join the next one
+        eps = int(np.ceil(self.eps))
+        carry = np.convolve(costs, np.ones(eps + 1))[: len(costs)]
+        carry = np.minimum(carry, budget / 2)
+        edges = []
+        chunk_cost = 0
+        for nr, cost in enumerate(costs):
+            if chunk_cost > 0 and chunk_cost + cost > budget:
+                edges.append(days[nr])
+                chunk_cost = carry[nr - 1]
+            chunk_cost += cost
+        bounds = [0, *np.searchsorted(self.detection_days(dfr), edges), len(dfr)]
+        chunks = [dfr.iloc[start:end].copy() for start, end in zip(bounds[:-1], bounds[1:])]
+        print(f"{len(chunks)} chunks of {[len(x) for x in chunks]} rows")
+        return chunks
+
+    @profiled("dataframe_to_db")
     def dataframe_to_db(self, dfr: pd.DataFrame):
         """Prepare, cluster and insert active fire detections
-        stored in Pandas DataFrame into the database
+        stored in Pandas DataFrame into the database. Detections
+        already in the database are skipped.
         """
-        start_g = time.time()
-        chunks = -(-len(dfr.index) // self.chunk_size)
-        dfrs = np.array_split(dfr, chunks, axis=0)
-        for nr, chunk in enumerate(dfrs):
-            print(f"doing chunk {nr}", chunk.shape)
-            self.consistency_check(chunk)
-            # increment index only to new data
-            chunk = self.increment_index(chunk)
-
-            # get active events
-            active = self.active_detections()
-            chunk = pd.concat([active, chunk])
-            # drop duplicates
-            chunk = chunk.drop_duplicates(subset=["longitude", "latitude", "date"])
-            # cluster new chunk and active
-            event, active_flag = self.cluster_dataframe(chunk)
-            chunk["event"] = event.astype(int)
-            # Try to preserve past event labels
-            chunk["event"] = self.event_ids(chunk)
-            chunk["active"] = active_flag.astype(int)
-
-            events_chunk = self.prepare_event_dataset(chunk)
+        dfr = self.drop_known(dfr)
+        if len(dfr) == 0:
+            return
+        dfrs = self.split_chunks(dfr)
+        if self.pipeline:
+            self.pipeline_to_db(dfrs)
+            return
+        try:
+            for nr, chunk in enumerate(dfrs):
+                print(f"doing chunk {nr}", chunk.shape)
+                chunk, events_chunk = self.transform(chunk)
+                self.load(chunk, events_chunk)
+        finally:
+            metrics.flush(self.sensor)
 
-            # delete active detections from the database
-            self.delete_active()
+    def pipeline_to_db(self, chunks, prepared: bool = True):
+        """Pipelined version of dataframe_to_db. Chunks (in date order)
+        are enriched (prepare_detections_dataset, unless prepared),
+        clustered and written to the database by three stages running
+        concurrently and connected by bounded queues: while chunk k is
+        clustered, chunk k+1 is enriched and chunk k-1 written.
+        Clustering runs in the calling thread in chunk order, with the
+        active detections and ids carried over in memory. Detections
+        already in the database are skipped. A failure in
+        any stage stops the others after their current chunk.
+        """
+        queue_size = self.config["CLUSTER"]["pipeline_queue_size"]
+        enriched = queue.Queue(maxsize=queue_size)
+        clustered = queue.Queue(maxsize=queue_size)
+        done = object()
+        errors = []
+        stop = threading.Event()
 
-            self.db.insert_events(events_chunk)
-            self.db.insert_active(chunk[chunk.active == 1])
-            self.db.insert_extinct(chunk[chunk.active == 0])
+        def put(q, item):
+            """Put item in q unless stopped, returns False if stopped"""
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q):
+            """Get item from q, done if stopped"""
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return done
+
+        def enrich():
+            try:
+                for chunk in chunks:
+                    if stop.is_set():
+                        return
+                    chunk = self.drop_known(chunk)
+                    if len(chunk) == 0:
+                        continue
+                    if not prepared:
+                        chunk = self.prepare_detections_dataset(chunk)
+                    if not put(enriched, chunk):
+                        return
+                put(enriched, done)
+            except Exception as exc:
+                errors.append(exc)
+                stop.set()
+
+        def write():
+            while True:
+                item = get(clustered)
+                if item is done:
+                    return
+                try:
+                    self.load(*item)
+                except Exception as exc:
+                    errors.append(exc)
+                    stop.set()
+                    return
+
+        enricher = threading.Thread(target=enrich, daemon=True)
+        writer = threading.Thread(target=write, daemon=True)
+        enricher.start()
+        writer.start()
+        try:
+            active = self.active_detections()
+            last_id = self.last_id()
+            nr = 0
+            while True:
+                chunk = get(enriched)
+                if chunk is done:
+                    break
+                print(f"doing chunk {nr}", chunk.shape)
+                if len(active) > 0:
+                    days_dif = (
+                        pd.to_datetime(chunk.date.min(), unit="s")
+                        - pd.to_datetime(active.date.max(), unit="s")
+                    ).days
+                    assert -2 < days_dif < 2, "DataFrame is not consistent with db"
+                chunk = chunk.copy()
+                chunk["id"] = range(last_id + 1, last_id + len(chunk) + 1)
+                last_id += len(chunk)
+                chunk, events_chunk = self.cluster_chunk(chunk, active)
+                if not put(clustered, (chunk, events_chunk)):
+                    break
+                active = self.stored_active(chunk)
+                nr += 1
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            put(clustered, done)
+            writer.join()
+            enricher.join()
+            metrics.flush(self.sensor)
+        if errors:
+            raise errors[0]
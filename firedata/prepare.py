@@ -1,26 +1,17 @@
 import os
+import re
 import glob
 import pathlib
+import functools
+import tempfile
 
 import numpy as np
 import pandas as pd
-from pyhdf import SD
 
 from .. import config
-from ._utils import dataset_dtypes, sql_datatypes, ModisGrid, FireDate
-
-
-def group_mode(
-    dfr: pd.DataFrame, group_cols: list[str], value_col: str, count_col: str
-) -> pd.DataFrame:
-    return (
-        dfr.groupby(group_cols + [value_col])
-        .size()
-        .to_frame(count_col)
-        .reset_index()
-        .sort_values(count_col, ascending=False)
-        .drop_duplicates(subset=group_cols)
-    )
+from . import metrics
+from .nrt_store import NRTStore
+from ._utils import dataset_dtypes, sql_datatypes, compact_dtypes, ModisGrid, FireDate
 
 
 def read_hdf4(dataset_path: str, dataset=None):
@@ -31,6 +22,8 @@ def read_hdf4(dataset_path: str, dataset=None):
     no dataset is given, the function returns pyhdf
     SD instance of the HDF-EOS file open in read mode.
     """
+    from pyhdf import SD
+
     try:
         product = SD.SD(dataset_path)
         if dataset == "all":
@@ -50,38 +43,236 @@ def read_hdf4(dataset_path: str, dataset=None):
         raise
 
 
-def add_admin(detections: pd.DataFrame, events: pd.DataFrame) -> pd.DataFrame:
-    """Add a column with country code to the events dataset"""
-    cn = group_mode(detections, ["event"], "admin", "gadmin")
-    events = pd.merge(events, cn[["event", "admin"]], on="event", how="left")
-    print(events.head)
-    return events
+# directory of the lookup tables memory mapped by several processes,
+# see share_lookups
+_shared_lookups = None
+
+
+def share_lookups(lookup_dir: str):
+    """Read the land cover tiles and the continents table through memory
+    mapped files in lookup_dir, so processes using the same directory
+    share one copy. Tiles are decoded to .npy files on first use, the
+    continents table is written by write_shared_continents."""
+    global _shared_lookups
+    _shared_lookups = lookup_dir
+    clear_caches()
+
+
+def _write_atomic(path: pathlib.Path, write):
+    """Call write with a temporary file object, then rename it to path,
+    so concurrent readers never see a partial file"""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as tmp_file:
+        write(tmp_file)
+    os.replace(tmp_path, path)
+
+
+@functools.lru_cache(maxsize=None)
+def lulc_tiles(lulc_data_path: str) -> dict:
+    """MCD12Q1 file names in lulc_data_path by (year, tile_h, tile_v).
+    Cached, see clear_caches."""
+    tiles = {}
+    for file_name in glob.glob(str(pathlib.Path(lulc_data_path, "*.hdf"))):
+        match = re.search(r"MCD12Q1\.A(\d{4})001\.h(\d{2})v(\d{2})", file_name)
+        if match is not None:
+            tiles[tuple(int(x) for x in match.groups())] = file_name
+    return tiles
+
+
+@functools.lru_cache(maxsize=64)
+def lulc_tile(file_name: str) -> np.ndarray:
+    """LC_Type1 land cover array of MCD12Q1 tile file_name, the
+    most recently used tiles are kept in memory. Memory mapped from
+    the shared lookups directory if set (see share_lookups)."""
+    if _shared_lookups is None:
+        return read_hdf4(file_name, "LC_Type1")
+    npy_path = pathlib.Path(_shared_lookups, f"{pathlib.Path(file_name).stem}.npy")
+    if not npy_path.exists():
+        tile = read_hdf4(file_name, "LC_Type1")
+        _write_atomic(npy_path, lambda x: np.save(x, tile))
+    return np.load(npy_path, mmap_mode="r")
+
+
+def write_shared_continents(lookup_dir: str, continents_path):
+    """Write the continents table of continents_path to lookup_dir as
+    an Arrow IPC file, read memory mapped by continents_table"""
+    import pyarrow.feather as feather
+
+    cids = _continents_table(continents_path)
+    _write_atomic(
+        pathlib.Path(lookup_dir, "continents.arrow"),
+        lambda x: feather.write_feather(cids, x, compression="uncompressed"),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def continents_table(continents_path) -> pd.DataFrame:
+    """Country code (admin) to continent lookup table, from the shared
+    lookups directory if set and written there"""
+    if _shared_lookups is not None:
+        shared_path = pathlib.Path(_shared_lookups, "continents.arrow")
+        if shared_path.exists():
+            import pyarrow.feather as feather
+
+            return feather.read_table(shared_path, memory_map=True).to_pandas()
+    return _continents_table(continents_path)
+
+
+def _continents_table(continents_path) -> pd.DataFrame:
+    cids = pd.read_parquet(continents_path)
+    cids = cids.rename({"Value": "admin", "Continent_Name": "continent"}, axis=1)
+    cids = cids.loc[(cids.continent.notna()), :]
+    return cids.groupby(["admin"])["continent"].first().reset_index()
+
 
+def clear_caches():
+    """Drop the cached land cover tiles and lookup tables, they are
+    read again on next use"""
+    lulc_tiles.cache_clear()
+    lulc_tile.cache_clear()
+    continents_table.cache_clear()
 
-def add_lc1(detections: pd.DataFrame, events: pd.DataFrame) -> pd.DataFrame:
-    """Add 'lc1' column with dominant (mode) land cover type for the event"""
-    lc = group_mode(detections, ["event"], "lc", "glc")
-    lc = lc.rename({"lc": "lc1"}, axis=1)
-    events = pd.merge(events, lc[["event", "lc1"]], on="event", how="left")
-    return events
 
+def _group_starts(codes: np.ndarray, n_groups: int) -> np.ndarray:
+    """Start positions of groups in an array sorted by group codes"""
+    counts = np.bincount(codes, minlength=n_groups)
+    return np.concatenate([[0], np.cumsum(counts)[:-1]])
 
-def add_vegetation_ratio(
-    detections: pd.DataFrame, events: pd.DataFrame
-) -> pd.DataFrame:
+
+def _group_median(codes: np.ndarray, values: np.ndarray, n_groups: int):
+    """Per group median of values (mean of the two middle values
+    for even sized groups, as pandas)"""
+    n = len(values)
+    order = np.argsort(values)
+    ranks = np.empty(n, dtype=np.int64)
+    ranks[order] = np.arange(n)
+    # a single int64 sort of (code, value rank) keys
+    keys = codes.astype(np.int64) * n + ranks
+    keys.sort()
+    values = values[order][keys % n].astype(float)
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = _group_starts(codes, n_groups)
+    lower = values[starts + (counts - 1) // 2]
+    upper = values[starts + counts // 2]
+    return (lower + upper) / 2
+
+
+def _group_runs(codes: np.ndarray, values: np.ndarray):
+    """Group codes, values and counts of the unique (code, value)
+    pairs of integer values (codes)"""
+    min_value = values.min()
+    span = np.int64(values.max() - min_value) + 1
+    keys = codes.astype(np.int64) * span + (values - min_value)
+    keys.sort()
+    new_run = np.ones(len(keys), dtype=bool)
+    new_run[1:] = keys[1:] != keys[:-1]
+    run_starts = np.flatnonzero(new_run)
+    run_counts = np.diff(np.append(run_starts, len(keys)))
+    run_keys = keys[run_starts]
+    return run_keys // span, run_keys % span + min_value, run_counts
+
+
+def _group_mode(codes: np.ndarray, values: np.ndarray, n_groups: int):
+    """Per group mode of values and its count. Missing values are
+    ignored, as by groupby, groups without values get nan and 0.
+    Ties resolve to the smallest value."""
+    value_codes, uniques = pd.factorize(values, sort=True)
+    modes = np.full(n_groups, np.nan)
+    mode_counts = np.zeros(n_groups, dtype=np.int64)
+    valid = value_codes >= 0
+    if not valid.any():
+        return modes, mode_counts
+    run_codes, run_values, run_counts = _group_runs(codes[valid], value_codes[valid])
+    group_starts = np.flatnonzero(np.diff(run_codes, prepend=-1))
+    max_counts = np.maximum.reduceat(run_counts, group_starts)
+    # runs are value sorted within a group, keep the first max run
+    max_counts = np.repeat(max_counts, np.diff(np.append(group_starts, len(run_codes))))
+    idx = np.flatnonzero(run_counts == max_counts)
+    first = np.ones(len(idx), dtype=bool)
+    first[1:] = run_codes[idx[1:]] != run_codes[idx[:-1]]
+    idx = idx[first]
+    modes[run_codes[idx]] = uniques[run_values[idx]]
+    mode_counts[run_codes[idx]] = run_counts[idx]
+    return modes, mode_counts
+
+
+def aggregate_events(detections: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per event dataset of the detections in a single pass. The event
+    column is factorised once and all statistics are computed with
+    bincount/reduceat kernels over the group codes: size, start and
+    last dates, median position, modal admin and land cover, vegetation
+    ratio and max daily size.
+    """
+    columns = ["event", "tot_size", "start_date", "last_date", "active"]
+    columns += ["longitude", "latitude", "admin", "lc1", "veg_ratio", "max_size"]
+    codes, events = pd.factorize(detections["event"].values, sort=True)
+    n_events = len(events)
+    if n_events == 0:
+        return pd.DataFrame(columns=columns)
+    tot_size = np.bincount(codes, minlength=n_events)
+    order = np.argsort(codes, kind="stable")
+    starts = _group_starts(codes, n_events)
+    dates = detections["date"].values
+    sorted_dates = dates[order]
+    vegetation_lcs = list(range(1, 13)) + [14]
+    is_veg = np.isin(detections["lc"].values, vegetation_lcs)
+    admin, _ = _group_mode(codes, detections["admin"].values, n_events)
+    lc1, _ = _group_mode(codes, detections["lc"].values, n_events)
+    _, max_size = _group_mode(codes, dates, n_events)
+    return pd.DataFrame(
+        {
+            "event": events,
+            "tot_size": tot_size,
+            "start_date": np.minimum.reduceat(sorted_dates, starts),
+            "last_date": np.maximum.reduceat(sorted_dates, starts),
+            "active": detections["active"].values[order[starts]],
+            "longitude": _group_median(codes, detections["longitude"].values, n_events),
+            "latitude": _group_median(codes, detections["latitude"].values, n_events),
+            "admin": admin,
+            "lc1": lc1,
+            "veg_ratio": np.bincount(codes, weights=is_veg, minlength=n_events)
+            / tot_size,
+            "max_size": max_size,
+        }
+    )
+
+
+def event_filter_mask(dfr: pd.DataFrame, rules: dict):
     """
-    Determine proportion of vegetation fire detections
-    and add a column to the events dataset.
+    Boolean mask of the dfr detections kept by the event filter rules
+    (a config EVENT_FILTER section) and a dict of per detection land
+    cover category ratios of their events. All category ratios come from
+    a single event by land cover count crosstab. Events with a category
+    ratio at or above the rule max_ratio are dropped, as are detections
+    of drop_types and within any of the exclude_bboxes [N, W, S, E].
     """
-    vegetation_lcs = list(range(1, 13))
-    vegetation_lcs.append(14)
-    lc_count = detections.groupby(["event"])["lc"].value_counts().unstack(fill_value=0)
-    veg_rat = lc_count.loc[:, lc_count.columns.isin(vegetation_lcs)].sum(
-        axis=1
-    ) / lc_count.sum(axis=1)
-    veg_rat = veg_rat.reset_index(name="veg_ratio")
-    events = pd.merge(events, veg_rat, on="event", how="left")
-    return events
+    lc_col = rules.get("lc_column", "lc")
+    codes, _ = pd.factorize(dfr["event"].values)
+    lc_codes, lcs = pd.factorize(dfr[lc_col].values)
+    # missing land cover counts in an extra column
+    n_lcs = len(lcs) + 1
+    lc_codes[lc_codes < 0] = len(lcs)
+    n_events = codes.max() + 1 if len(codes) > 0 else 0
+    crosstab = np.bincount(
+        codes * n_lcs + lc_codes, minlength=n_events * n_lcs
+    ).reshape(n_events, n_lcs)
+    totals = crosstab.sum(axis=1)
+    drop_event = np.zeros(n_events, dtype=bool)
+    ratios = {}
+    for rule in rules.get("rules", []):
+        columns = np.append(np.isin(lcs, rule["lc"]), False)
+        ratio = crosstab[:, columns].sum(axis=1) / totals
+        drop_event |= ratio >= rule["max_ratio"]
+        ratios[rule["name"]] = ratio[codes]
+    keep = ~drop_event[codes]
+    if rules.get("drop_types"):
+        keep &= ~dfr["type"].isin(rules["drop_types"]).values
+    lats = dfr["latitude"].values
+    lons = dfr["longitude"].values
+    for north, west, south, east in rules.get("exclude_bboxes", []):
+        keep &= ~((lats < north) & (lats > south) & (lons > west) & (lons < east))
+    return keep, ratios
 
 
 class PrepData:
@@ -90,11 +281,28 @@ class PrepData:
         self.config = config.config_dict
         self.date_now = pd.Timestamp.utcnow()
 
+    def dtypes(self, dtypes_dict_key):
+        """Dtype dictionary, the compact version if DATABASE
+        compact_dtypes is set and there is one"""
+        if self.config["DATABASE"]["compact_dtypes"]:
+            return compact_dtypes.get(dtypes_dict_key, sql_datatypes[dtypes_dict_key])
+        return sql_datatypes[dtypes_dict_key]
+
+    def firms_dtypes(self, dfr: pd.DataFrame = None):
+        """Dtypes for reading FIRMS datasets (of dfr columns only if
+        given), None unless DATABASE compact_dtypes is set"""
+        if not self.config["DATABASE"]["compact_dtypes"]:
+            return None
+        dtypes = compact_dtypes["FIRMS_dtypes"]
+        if dfr is not None:
+            dtypes = {k: v for k, v in dtypes.items() if k in dfr}
+        return dtypes
+
     def columns_dtypes(self, dataset, dtypes_dict_key):
         """Selects required columns and sets data types as per
         dtype dictionary.
         """
-        sql_dtypes = sql_datatypes[dtypes_dict_key]
+        sql_dtypes = self.dtypes(dtypes_dict_key)
         dataset = dataset[sql_dtypes.keys()]
         dataset = dataset.astype(sql_dtypes)
         return dataset
@@ -106,9 +314,11 @@ class PrepData:
         columns only. Works (or at least should) both with archive and nrt
         datasets. TODO a lot going on here, perhaps split.
         """
+        rows = len(dataset)
         # If no date column add one
         if "date" not in dataset:
-            dataset["date"] = FireDate.fire_dates(dataset)
+            with metrics.stage(self.sensor, "date_conversion", rows):
+                dataset["date"] = FireDate.fire_dates(dataset)
         # If no type column assume nrt dataset
         if "type" not in dataset:
             dataset["type"] = 4
@@ -117,15 +327,20 @@ class PrepData:
             dataset["event"] = -1
         if "id" not in dataset:
             dataset["id"] = -1
-        # remap daynight to integer
-        daynight_map = {"D": 1, "N": 0}
-        dataset["daynight"] = dataset["daynight"].map(daynight_map)
+        # remap daynight to integer, unless read from the archive parquet
+        if not pd.api.types.is_numeric_dtype(dataset["daynight"]):
+            daynight_map = {"D": 1, "N": 0}
+            dataset["daynight"] = dataset["daynight"].map(daynight_map)
         # Add country code
-        dataset["admin"] = self.country_code(dataset)
+        with metrics.stage(self.sensor, "admin", rows):
+            dataset["admin"] = self.country_code(dataset)
         # Add land cover
-        dataset = self.modis_lulc(dataset)
+        with metrics.stage(self.sensor, "land_cover", rows):
+            dataset = self.modis_lulc(dataset)
         # datetime to unix time
-        dataset["date"] = FireDate.unix_time(dataset["date"])
+        if pd.api.types.is_datetime64_any_dtype(dataset["date"]):
+            with metrics.stage(self.sensor, "date_conversion", rows):
+                dataset["date"] = FireDate.unix_time(dataset["date"])
         # sort by date
         dataset = dataset.sort_values(by="date").reset_index(drop=True)
         # select required columns
@@ -134,65 +349,22 @@ class PrepData:
 
     def prepare_event_dataset(self, dataset: pd.DataFrame) -> pd.DataFrame:
         """Generate per event dataset."""
-        dfg = dataset.groupby("event")
-        dfg = dfg.agg(
-            tot_size=("type", "count"),
-            start_date=("date", "min"),
-            last_date=("date", "max"),
-            active=("active", "first"),
-            longitude=("longitude", "median"),
-            latitude=("latitude", "median"),
-        ).reset_index()
-        # dfg = pd.merge(dfg, lc[['event', 'lc']], on = 'event', how = 'left')
-        dfg = add_admin(dataset, dfg)
-        dfg = add_lc1(dataset, dfg)
-        dfg = add_vegetation_ratio(dataset, dfg)
-        dfg = self.add_continent(dfg)
-        # dfg['duration'] = dfg.last_date - dfg.start_date
-        max_size = dataset.groupby(["event", "date"])["type"].count()
-        dfg["max_size"] = max_size.groupby(level=0).max().values
-        dfg["name"] = None
-        dfg = self.columns_dtypes(dfg, "SQL_events_dtypes")
+        with metrics.stage(self.sensor, "event_aggregation", len(dataset)) as rec:
+            dfg = aggregate_events(dataset)
+            dfg = self.add_continent(dfg)
+            dfg["name"] = None
+            dfg = self.columns_dtypes(dfg, "SQL_events_dtypes")
+            rec["rows_out"] = len(dfg)
         return dfg
 
     def filter_non_vegetation_events(self, dfr):
         """
         Drop fire events which are primarily non_vegetation detections,
-        (water and urban) and also unclassified
+        (water, urban, barren) and also unclassified. The rules are
+        set in the EVENT_FILTER.vegetation config section.
         """
-        vegetation_lcs = list(range(1, 13))
-        vegetation_lcs.append(14)
-        lc_count = dfr.groupby(["event"])["lc"].value_counts().unstack(fill_value=0)
-        veg_rat = lc_count[vegetation_lcs] / lc_count.sum(axis=1)
-        # drop detections which are classed as static
-        # drop urban events (> 50% urban detections)
-        if 13 in lc_count:
-            urban_rat = lc_count[13] / (lc_count.sum(axis=1))
-            urban_rat = urban_rat.reset_index(name="urban_ratio")
-            dfr = dfr.merge(urban_rat, on="event")
-            dfr = dfr[dfr.urban_ratio < 0.5]
-            dfr = dfr.drop("urban_ratio", axis=1)
-        if any(x in [15, 16, 17] for x in lc_count):
-            barren_rat = lc_count[[15, 16, 17]].sum(axis=1) / (lc_count.sum(axis=1))
-            barren_rat = barren_rat.reset_index(name="barren_ratio")
-            dfr = dfr.merge(barren_rat, on="event")
-            dfr = dfr[dfr.barren_ratio < 0.5]
-            dfr = dfr.drop("barren_ratio", axis=1)
-
-        # drop water events and unclassified (> 50% water detections)
-        if 0 in lc_count:
-            water_rat = lc_count[0] / (lc_count.sum(axis=1))
-            water_rat = water_rat.reset_index(name="water_ratio")
-            dfr = dfr.merge(water_rat, on="event")
-            dfr = dfr[dfr.water_ratio < 0.5]
-            dfr = dfr.drop("water_ratio", axis=1)
-        if 255 in lc_count:
-            unclass_rat = lc_count[255] / (lc_count.sum(axis=1))
-            water_rat = unclass_rat.reset_index(name="unclass_rat")
-            dfr = dfr.merge(unclass_rat, on="event")
-            dfr = dfr[dfr.unclass_rat < 0.5]
-            dfr = dfr.drop("unclass_ratio", axis=1)
-        return dfr
+        keep, _ = event_filter_mask(dfr, self.config["EVENT_FILTER"]["vegetation"])
+        return dfr[keep]
 
     def modis_lulc(self, dataset):
         """Add land cover from MODIS MCD12Q1 product"""
@@ -208,18 +380,15 @@ class PrepData:
         grouped = dfr.groupby(["tile_h", "tile_v"])
         dfrs = []
         lulc_year = self.modis_lulc_year(dataset)
+        tiles = lulc_tiles(lulc_data_path)
         for name, gr in grouped:
             tile_h = name[0]
             tile_v = name[1]
-            lulc_fname = pathlib.Path(
-                lulc_data_path, f"MCD12Q1.A{lulc_year}001.h{tile_h:02}v{tile_v:02}*"
-            )
             try:
-                lulc_fname = glob.glob(str(lulc_fname))[0]
-                dslc = read_hdf4(lulc_fname)
-                gr["lc"] = dslc.select("LC_Type1").get()[gr["indy"], gr["indx"]]
-            except IndexError:
-                print("tile not found: ", lulc_fname)
+                lulc_fname = tiles[(lulc_year, tile_h, tile_v)]
+                gr["lc"] = lulc_tile(lulc_fname)[gr["indy"], gr["indx"]]
+            except KeyError:
+                print("tile not found: ", lulc_year, tile_h, tile_v)
                 gr["lc"] = 0
             gr = gr.drop(["tile_h", "tile_v", "indx", "indy"], axis=1)
             dfrs.append(gr)
@@ -230,10 +399,8 @@ class PrepData:
     def modis_lulc_year(self, dataset):
         """Returns the closest year in available MCD12Q1 product to
         mode year of the fire detections dataset"""
-        lulc_data_path = pathlib.Path(self.config["OS"]["lulc_data_path"], "*.hdf")
-        file_names = glob.glob(str(lulc_data_path))
-        years = [int(x.split(".A")[1][:4]) for x in file_names]
-        years_unique = np.unique(years)
+        tiles = lulc_tiles(self.config["OS"]["lulc_data_path"])
+        years_unique = np.unique([x[0] for x in tiles])
         dataset_year = dataset["date"].dt.year.value_counts().index[0]
         lulc_year = years_unique[np.argmin(np.abs((years_unique - dataset_year)))]
         return lulc_year
@@ -246,14 +413,18 @@ class PrepData:
             self.config["OS"]["admin_data_path"],
             "gpw_v4_national_identifier_grid_rev11_30_sec.tif",
         )
-        dfr[["longitude", "latitude"]].to_csv(
-            "input.csv", sep=" ", index=False, header=False
-        )
-        os.system(
-            r'gdallocationinfo -valonly -wgs84 "%s" <%s >%s'
-            % (file_path, "input.csv", "output.csv")
-        )
-        admin = np.loadtxt("output.csv")
+        # unique file names, several processes may run this concurrently
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_csv = os.path.join(tmp_dir, "input.csv")
+            output_csv = os.path.join(tmp_dir, "output.csv")
+            dfr[["longitude", "latitude"]].to_csv(
+                input_csv, sep=" ", index=False, header=False
+            )
+            os.system(
+                r'gdallocationinfo -valonly -wgs84 "%s" <%s >%s'
+                % (file_path, input_csv, output_csv)
+            )
+            admin = np.loadtxt(output_csv)
         return admin.astype(int)
 
     def add_continent(self, dfr: pd.DataFrame):
@@ -261,10 +432,7 @@ class PrepData:
         continents_path = pathlib.Path(
             self.config["OS"]["admin_data_path"], "countries_continents.parquet"
         )
-        cids = pd.read_parquet(continents_path)
-        cids = cids.rename({"Value": "admin", "Continent_Name": "continent"}, axis=1)
-        cids = cids.loc[(cids.continent.notna()), :]
-        cidsg = cids.groupby(["admin"])["continent"].first().reset_index()
+        cidsg = continents_table(continents_path)
         dfr = pd.merge(dfr, cidsg[["admin", "continent"]], on="admin", how="left")
         # Russia east of 50deg longitude is considered Asia
         dfr.loc[((dfr.admin == 643) & (dfr.longitude > 50)), "continent"] = "Asia"
@@ -287,33 +455,13 @@ class PrepData:
         return dataset
 
     def merge_nrt(self, nrt_new):
-        """Merges the fetched data (nrt_new) to nrt_completed and
-        overwrites the nrt_completed file at nrt_dataset_path
+        """Appends the fetched and prepared data (nrt_new) to the nrt
+        store as a new fragment, detections already stored are dropped
         """
-        nrt_completed = pd.read_parquet(self.nrt_dataset_path)
-        # Is index increment needed?
-        index_increment = nrt_completed.index[0]
-        nrt_updated = pd.concat([nrt_completed, nrt_new])
-        tot_rows = nrt_updated.shape[0]
-        nrt_updated = nrt_updated.drop_duplicates()
-        rows_dropped = tot_rows - nrt_updated.shape[0]
-        rows_added = nrt_new.shape[0] - rows_dropped
-        if rows_added > 0:
-            self.logger.info(f"Adding {rows_added} active fires to nrt record")
-            # write the updated file
-            nrt_updated = nrt_updated.reset_index(drop=True)
-            nrt_updated.index = nrt_updated.index + index_increment
-            nrt_updated.to_parquet(self.nrt_dataset_path)
-            self.log_nrt_end_date(nrt_updated)
-        else:
-            self.logger.info(f"No new fire detections, snooze")
+        return NRTStore(self.sensor).append(nrt_new)
 
     def drop_in_archive_nrt(self):
-        """Select nrt data starting after archive_end datetime.
+        """Drop nrt data up to the sensor archive_end datetime.
         Used to reduce nrt dataset after archive update.
-        WARNING: overwrites the file at nrt_dataset_path!
         """
-        nrt = pd.read_parquet(self.nrt_dataset_path)
-        archive_end_dt = pd.Timestamp(self.archive_end)
-        nrt_selected = nrt[nrt.date.values > archive_end_dt]
-        nrt_selected.to_parquet(self.nrt_dataset_path)
+        NRTStore(self.sensor).drop_in_archive(self.config[self.sensor]["archive_end"])
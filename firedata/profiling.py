@@ -0,0 +1,152 @@
+"""
+Optional profiling of the ProcSQL entry points (fetch_nrt, transform,
+load of the in memory nrt run, get_nrt, transform_nrt, load_nrt of the
+checkpointed one, populate_archive, dataframe_to_db). Enabled by
+[PROFILING] mode or the ACTIVEFIRE_PROFILE environment variable:
+
+    cprofile  deterministic profile, <stage>.prof (pstats) and .txt summary
+    sampling  stack samples of the stage thread, <stage>.folded (flame graph)
+
+and allocation tracing by [PROFILING] tracemalloc or ACTIVEFIRE_TRACEMALLOC=1,
+<stage>_tracemalloc.txt. The artefacts are written to
+<data_path>/<PROFILING path>/ named <sensor>_<stage>_<utc time>.
+"""
+import os
+import sys
+import time
+import functools
+import threading
+import collections
+from pathlib import Path
+
+import pandas as pd
+
+from activefire import config
+
+# calls made while a profiled call runs, in any thread (e.g. load in
+# the pipeline_to_db writer), are not profiled again: the profilers
+# and tracemalloc are process wide
+_active = threading.Lock()
+
+
+def settings() -> dict:
+    """[PROFILING] settings with the environment overrides applied"""
+    cfg = dict(config.config_dict["PROFILING"])
+    cfg["mode"] = os.environ.get("ACTIVEFIRE_PROFILE", cfg["mode"]).lower()
+    if "ACTIVEFIRE_TRACEMALLOC" in os.environ:
+        cfg["tracemalloc"] = os.environ["ACTIVEFIRE_TRACEMALLOC"] not in ("", "0")
+    return cfg
+
+
+class StackSampler(object):
+    """Samples the stack of thread ident every interval seconds in a
+    background thread, counts identical stacks"""
+
+    def __init__(self, ident: int, interval: float):
+        self.ident = ident
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{Path(code.co_filename).name}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: Path):
+        """Write the samples in collapsed (folded) stack format"""
+        with open(path, "w") as fp:
+            for stack, count in self.stacks.most_common():
+                fp.write(f"{stack} {count}\n")
+
+
+def profile_call(func, stage: str, sensor: str, cfg: dict, *args, **kwargs):
+    """Call func(*args, **kwargs) under the profilers enabled in cfg
+    and write the artefacts of stage"""
+    out_dir = Path(config.config_dict["OS"]["data_path"], cfg["path"])
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stamp = pd.Timestamp.utcnow().strftime("%Y%m%dT%H%M%S")
+    prefix = Path(out_dir, f"{sensor}_{stage}_{stamp}")
+    profiler = sampler = None
+    if cfg["mode"] == "cprofile":
+        import cProfile
+
+        profiler = cProfile.Profile()
+    elif cfg["mode"] == "sampling":
+        sampler = StackSampler(threading.get_ident(), cfg["sample_interval_ms"] / 1000)
+    if cfg["tracemalloc"]:
+        import tracemalloc
+
+        tracemalloc.start(cfg["tracemalloc_frames"])
+    start = time.perf_counter()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        if sampler is not None:
+            sampler.start()
+        return func(*args, **kwargs)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if sampler is not None:
+            sampler.stop()
+        print(f"profiled {stage}: {time.perf_counter() - start:.1f} s, {prefix}*")
+        if profiler is not None:
+            import pstats
+
+            profiler.dump_stats(f"{prefix}.prof")
+            with open(f"{prefix}.txt", "w") as fp:
+                stats = pstats.Stats(profiler, stream=fp)
+                stats.sort_stats("cumulative").print_stats(cfg["top"])
+        if sampler is not None:
+            sampler.write(Path(f"{prefix}.folded"))
+        if cfg["tracemalloc"]:
+            # without the allocations of the profilers
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [
+                    tracemalloc.Filter(False, __file__),
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                ]
+            )
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(f"{prefix}_tracemalloc.txt", "w") as fp:
+                fp.write(f"peak traced memory: {peak / 2**20:.1f} MiB\n")
+                for stat in snapshot.statistics("lineno")[: cfg["top"]]:
+                    fp.write(f"{stat}\n")
+
+
+def profiled(stage: str):
+    """Decorator of ProcSQL methods, profiles the call as stage if
+    profiling is enabled (see module docstring)"""
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cfg = settings()
+            if cfg["mode"] not in ("cprofile", "sampling") and not cfg["tracemalloc"]:
+                return method(self, *args, **kwargs)
+            if not _active.acquire(blocking=False):
+                return method(self, *args, **kwargs)
+            try:
+                return profile_call(method, stage, self.sensor, cfg, self, *args, **kwargs)
+            finally:
+                _active.release()
+
+        return wrapper
+
+    return decorator
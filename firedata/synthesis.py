@@ -1,5 +1,4 @@
 import pandas as pd
-from firedata import database
 from firedata import populate_db
 
 continents_dict = {}
@@ -18,7 +17,14 @@ SELECT * FROM (
 where continent_count <= 50;
 """
 events_sql = "SELECT * FROM events WHERE tot_size > 20"
+# top events per continent from the maintained ranking
+top_europe = pc.top_events("Europe", 50)
+# reporting queries run on the columnar analytics engine
+top_events = pc.analytics_query(sql_str)
+large_events = pc.analytics_query(events_sql)
 
-sql_uk = """SELECT * FROM detections_extinct WHERE admin == 826"""
-dfr = pc.db.return_many_values(sql_uk)
+sql_uk = """SELECT * FROM detections_extinct WHERE admin == ?"""
+# large exports are written chunk by chunk, in constant memory
+uk_rows = pc.db.export_parquet(sql_uk, "uk_detections.parquet", params=(826,))
+# pc.db.export_parquet("SELECT * FROM detections_extinct", "extinct.parquet")
 # dfr = pd.read_parquet("firedata/data/active_detections.parquet")
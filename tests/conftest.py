@@ -0,0 +1,70 @@
+"""
+Fixtures shared by the tests: synthetic FIRMS detections and a
+temporary data directory with country code and land cover replaced,
+so no raster data is needed.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("activefire")
+
+from activefire import config
+from activefire.firedata import prepare
+
+
+def firms_detections(start: str, days: int, n_per_day: int = 200) -> pd.DataFrame:
+    """Synthetic FIRMS nrt detections, clustered around 20 fires a day"""
+    rng = np.random.default_rng(0)
+    dfrs = []
+    for day in pd.date_range(start, periods=days, freq="D"):
+        centres = rng.integers(0, 20, n_per_day)
+        lon = rng.uniform(-5, 5, 20)[centres] + rng.normal(0, 0.01, n_per_day)
+        lat = rng.uniform(45, 55, 20)[centres] + rng.normal(0, 0.01, n_per_day)
+        dfrs.append(
+            pd.DataFrame(
+                {
+                    "latitude": lat.round(4),
+                    "longitude": lon.round(4),
+                    "bright_ti4": 300.0,
+                    "scan": 0.4,
+                    "track": 0.4,
+                    "acq_date": day.strftime("%Y-%m-%d"),
+                    "acq_time": rng.integers(0, 24, n_per_day) * 100
+                    + rng.integers(0, 60, n_per_day),
+                    "satellite": "N",
+                    "instrument": "VIIRS",
+                    "confidence": "n",
+                    "version": "2.0NRT",
+                    "bright_ti5": 290.0,
+                    "frp": rng.uniform(0, 20, n_per_day).round(2),
+                    "daynight": rng.choice(["D", "N"], n_per_day),
+                }
+            )
+        )
+    return pd.concat(dfrs).reset_index(drop=True)
+
+
+@pytest.fixture
+def data_path(tmp_path, monkeypatch):
+    """Temporary data directory, country code and land cover without
+    the raster data"""
+    cfg = config.config_dict
+    monkeypatch.setitem(cfg["OS"], "data_path", str(tmp_path))
+    monkeypatch.setitem(cfg["OS"], "admin_data_path", str(tmp_path))
+    monkeypatch.setitem(cfg["CLUSTER"], "pipeline", False)
+    monkeypatch.setitem(cfg["METRICS"], "enabled", False)
+    pd.DataFrame({"Value": [250, 826], "Continent_Name": ["Europe", "Europe"]}).to_parquet(
+        tmp_path / "countries_continents.parquet"
+    )
+
+    def country_code(self, dfr):
+        return np.where(dfr.longitude.values > 0, 250, 826)
+
+    def modis_lulc(self, dataset):
+        return dataset.assign(lc=(np.abs(dataset.longitude.values * 10).astype(int) % 17))
+
+    monkeypatch.setattr(prepare.PrepData, "country_code", country_code)
+    monkeypatch.setattr(prepare.PrepData, "modis_lulc", modis_lulc)
+    prepare.clear_caches()
+    return tmp_path
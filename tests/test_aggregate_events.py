@@ -0,0 +1,110 @@
+"""
+aggregate_events against the pandas groupby aggregation it replaced.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("activefire")
+
+from activefire.firedata.prepare import aggregate_events
+
+
+def group_mode(dfr, group_cols, value_col, count_col):
+    return (
+        dfr.groupby(group_cols + [value_col])
+        .size()
+        .to_frame(count_col)
+        .reset_index()
+        .sort_values(count_col, ascending=False, kind="stable")
+        .drop_duplicates(subset=group_cols)
+    )
+
+
+def groupby_events(dataset: pd.DataFrame) -> pd.DataFrame:
+    """The groupby aggregation of prepare_event_dataset before
+    aggregate_events. The stable sort makes mode ties resolve to the
+    smallest value, as in aggregate_events (before they depended on
+    the sort order)."""
+    dfg = dataset.groupby("event")
+    dfg = dfg.agg(
+        tot_size=("type", "count"),
+        start_date=("date", "min"),
+        last_date=("date", "max"),
+        active=("active", "first"),
+        longitude=("longitude", "median"),
+        latitude=("latitude", "median"),
+    ).reset_index()
+    cn = group_mode(dataset, ["event"], "admin", "gadmin")
+    dfg = pd.merge(dfg, cn[["event", "admin"]], on="event", how="left")
+    lc = group_mode(dataset, ["event"], "lc", "glc").rename({"lc": "lc1"}, axis=1)
+    dfg = pd.merge(dfg, lc[["event", "lc1"]], on="event", how="left")
+    vegetation_lcs = list(range(1, 13)) + [14]
+    lc_count = dataset.groupby(["event"])["lc"].value_counts().unstack(fill_value=0)
+    veg_rat = lc_count.loc[:, lc_count.columns.isin(vegetation_lcs)].sum(
+        axis=1
+    ) / lc_count.sum(axis=1)
+    dfg = pd.merge(dfg, veg_rat.reset_index(name="veg_ratio"), on="event", how="left")
+    max_size = dataset.groupby(["event", "date"])["type"].count()
+    dfg["max_size"] = max_size.groupby(level=0).max().values
+    return dfg
+
+
+def detections(n: int = 2000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "event": rng.integers(0, 150, n) * 7,
+            "type": 0,
+            "date": 1622505600 + rng.integers(0, 20, n) * 3600,
+            "active": rng.integers(0, 2, n),
+            "longitude": rng.uniform(-10, 10, n).round(4),
+            "latitude": rng.uniform(40, 60, n).round(4),
+            "admin": rng.choice([250.0, 826.0, 372.0, np.nan], n, p=[0.4, 0.3, 0.2, 0.1]),
+            "lc": rng.integers(0, 17, n),
+        }
+    )
+
+
+def assert_same_events(dataset: pd.DataFrame):
+    expected = groupby_events(dataset)
+    result = aggregate_events(dataset)
+    pd.testing.assert_frame_equal(
+        result[expected.columns], expected, check_dtype=False
+    )
+
+
+def test_matches_groupby():
+    assert_same_events(detections())
+
+
+def test_single_row_events():
+    dataset = detections(50, seed=1)
+    dataset["event"] = np.arange(50)
+    assert_same_events(dataset)
+
+
+def test_mode_ties_resolve_to_smallest_value():
+    dataset = pd.DataFrame(
+        {
+            "event": [1, 1, 1, 1, 2, 2, 3],
+            "type": 0,
+            "date": [10, 10, 20, 20, 30, 40, 50],
+            "active": [1, 0, 0, 0, 0, 0, 1],
+            "longitude": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0],
+            "latitude": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0],
+            "admin": [826.0, 250.0, 826.0, 250.0, np.nan, np.nan, 372.0],
+            "lc": [12, 5, 5, 12, 3, 4, 17],
+        }
+    )
+    result = aggregate_events(dataset).set_index("event")
+    assert result.loc[1, "admin"] == 250
+    assert result.loc[1, "lc1"] == 5
+    assert result.loc[1, "max_size"] == 2
+    assert np.isnan(result.loc[2, "admin"])
+    assert result.loc[2, "lc1"] == 3
+    assert_same_events(dataset)
+
+
+def test_no_detections():
+    assert len(aggregate_events(detections().iloc[:0])) == 0
@@ -0,0 +1,82 @@
+"""
+The archive parquet dataset: detections table dtypes and populating
+the database from it as from the archive csv files.
+"""
+import pandas as pd
+import pytest
+
+pytest.importorskip("activefire")
+pytest.importorskip("pyarrow")
+
+from activefire import config
+from activefire.firedata import archive
+from activefire.firedata._utils import sql_datatypes
+from activefire.firedata.populate_db import ProcSQL
+from conftest import firms_detections
+
+SENSOR = "VIIRS_NPP"
+
+
+def write_archive_csv(data_path) -> str:
+    """FIRMS archive csv spanning the end of 2020, one detection a
+    minute so the date order is unique"""
+    dfr = firms_detections("2020-12-28", 6).assign(type=0)
+    dfr = dfr.drop_duplicates(["acq_date", "acq_time"])
+    (data_path / SENSOR).mkdir(exist_ok=True)
+    fname = str(data_path / SENSOR / "fire_archive_SV-C2_test.csv")
+    dfr.to_csv(fname, index=False)
+    return fname
+
+
+def populated_tables(data_path, name: str, source: str) -> dict:
+    """Detections and events tables populated with populate_archive
+    from the archive source, in data_path/name"""
+    path = data_path / name
+    path.mkdir()
+    config.config_dict["OS"]["data_path"] = str(path)
+    config.config_dict["CLUSTER"]["archive_source"] = source
+    fname = write_archive_csv(path)
+    archive.convert_file(SENSOR, fname, str(path / "archive_parquet"))
+    proc = ProcSQL(SENSOR)
+    for table in ["extinct", "active", "events"]:
+        proc.db.execute_sql(config.config_dict["SQL"][f"sql_create_{table}_table"])
+    proc.populate_archive()
+    return {
+        table: proc.db.return_many_values(f"SELECT * FROM {table}")
+        .sort_values(key)
+        .reset_index(drop=True)
+        for table, key in [
+            ("detections_extinct", "id"),
+            ("detections_active", "id"),
+            ("events", "event"),
+        ]
+    }
+
+
+def test_converted_dtypes(data_path):
+    fname = write_archive_csv(data_path)
+    out_path = str(data_path / "archive_parquet")
+    assert archive.convert_file(SENSOR, fname, out_path) == len(pd.read_csv(fname))
+    years = sorted(data_path.glob(f"archive_parquet/sensor={SENSOR}/year=*"))
+    assert [x.name for x in years] == ["year=2020", "year=2021"]
+    dfr = pd.read_parquet(next(years[0].glob("*.parquet")))
+    dtypes = sql_datatypes["SQL_detections_dtypes"]
+    assert list(dfr.columns) == [x for x in dtypes if x in dfr]
+    assert set(dfr.columns) == {"latitude", "longitude", "frp", "daynight", "type", "date"}
+    for column in dfr:
+        assert dfr[column].dtype == pd.Series([], dtype=dtypes[column]).dtype
+    assert dfr.date.is_monotonic_increasing
+    assert set(dfr.daynight) <= {0, 1}
+
+
+@pytest.mark.parametrize("stream_archive", [False, True])
+def test_parquet_source_matches_csv(data_path, monkeypatch, stream_archive):
+    monkeypatch.setitem(config.config_dict["CLUSTER"], "stream_archive", stream_archive)
+    monkeypatch.setitem(config.config_dict["CLUSTER"], "archive_source", "csv")
+    monkeypatch.setitem(config.config_dict["CLUSTER"], "archive_read_rows", 150)
+    monkeypatch.setitem(config.config_dict["CLUSTER"], "chunk_size", 400)
+    expected = populated_tables(data_path, "csv", "csv")
+    result = populated_tables(data_path, "parquet", "parquet")
+    assert len(expected["detections_extinct"]) > 0
+    for table, dfr in expected.items():
+        pd.testing.assert_frame_equal(result[table], dfr, check_dtype=False)
@@ -0,0 +1,26 @@
+"""
+Spawned worker processes use the configuration of the parent.
+"""
+import multiprocessing
+import concurrent.futures
+
+import pytest
+
+pytest.importorskip("activefire")
+
+from activefire import config
+
+
+def cluster_settings(_):
+    return config.config_dict["CLUSTER"]
+
+
+def test_installed_config_reaches_spawned_workers(monkeypatch):
+    monkeypatch.setitem(config.config_dict["CLUSTER"], "chunk_size", 1234)
+    mp_context = multiprocessing.get_context("spawn")
+    pool = concurrent.futures.ProcessPoolExecutor(
+        2, mp_context, initializer=config.install, initargs=(config.config_dict,)
+    )
+    with pool:
+        settings = list(pool.map(cluster_settings, range(2)))
+    assert [x["chunk_size"] for x in settings] == [1234, 1234]
@@ -0,0 +1,102 @@
+"""
+detection_keys at the edges of the key fields and drop_known against
+the detections already stored.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("activefire")
+
+from activefire import config
+from activefire.firedata._utils import FireDate, detection_keys
+from activefire.firedata.populate_db import ProcSQL
+from conftest import firms_detections
+
+EPOCH = 946684800
+# last minute of the 26 bit time field
+LAST_MINUTE = EPOCH + (2**26 - 1) * 60
+
+
+def assert_distinct(lons, lats, dates):
+    keys = detection_keys(lons, lats, dates)
+    assert (keys >= 0).all()
+    assert len(np.unique(keys)) == len(keys)
+    return keys
+
+
+def test_distinct_at_poles():
+    lats = [-90, -89.999, 89.999, 90]
+    assert_distinct([0, 0, 0, 0], lats, [EPOCH] * 4)
+    assert_distinct([-180, 180, -180, 180], [-90, -90, 90, 90], [EPOCH] * 4)
+
+
+def test_distinct_across_antimeridian():
+    lons = [-180, -179.999, 179.999, 180]
+    assert_distinct(lons, [0, 0, 0, 0], [LAST_MINUTE] * 4)
+    assert_distinct(lons, [90, 90, 90, 90], [EPOCH] * 4)
+
+
+def test_distinct_at_minute_range_limits():
+    dates = [EPOCH, EPOCH + 60, LAST_MINUTE - 60, LAST_MINUTE]
+    keys = assert_distinct([180, 180, -180, -180], [90, 90, -90, -90], dates)
+    # time is the most significant field
+    assert (np.diff(keys) > 0).all()
+
+
+def test_distinct_at_quantisation_step():
+    base = detection_keys([12.345], [-45.678], [EPOCH + 3600])
+    neighbours = detection_keys(
+        [12.346, 12.344, 12.345, 12.345, 12.345],
+        [-45.678, -45.678, -45.677, -45.679, -45.678],
+        [EPOCH + 3600] * 4 + [EPOCH + 3660],
+    )
+    assert not np.isin(neighbours, base).any()
+    # within the same minute and 0.001 deg
+    assert detection_keys([12.3452], [-45.6781], [EPOCH + 3659]) == base
+
+
+@pytest.fixture
+def proc(data_path):
+    """ProcSQL with five days of detections in the database"""
+    proc = ProcSQL("VIIRS_NPP")
+    for table in ["extinct", "active", "events"]:
+        proc.db.execute_sql(config.config_dict["SQL"][f"sql_create_{table}_table"])
+    dataset = proc.prepare_detections_dataset(firms_detections("2021-06-01", 5))
+    proc.dataframe_to_db(dataset)
+    return proc
+
+
+def stored_keys(proc: ProcSQL) -> np.ndarray:
+    columns = ["longitude", "latitude", "date"]
+    stored = pd.concat(
+        list(proc.db.extinct_chunks(columns))
+        + [proc.db.return_many_values("SELECT * FROM detections_active")[columns]]
+    )
+    return detection_keys(stored.longitude, stored.latitude, stored.date)
+
+
+def test_drop_known_removes_stored_rows(proc):
+    fetched = firms_detections("2021-06-01", 8)
+    result = proc.drop_known(fetched)
+    dates = FireDate.unix_time(FireDate.fire_dates(fetched))
+    keys = detection_keys(fetched.longitude, fetched.latitude, dates)
+    known = np.isin(keys, stored_keys(proc))
+    assert known.sum() == len(fetched) - len(result)
+    pd.testing.assert_frame_equal(result, fetched[~known])
+    # the stored days are dropped, the new ones kept
+    days = pd.to_datetime(result.acq_date)
+    assert (days >= "2021-06-06").all()
+    assert len(result) == (pd.to_datetime(fetched.acq_date) >= "2021-06-06").sum()
+
+
+def test_drop_known_keeps_near_misses(proc):
+    fetched = proc.drop_known(firms_detections("2021-06-01", 1))
+    assert len(fetched) == 0
+    stored = firms_detections("2021-06-01", 1)
+    shifted = [
+        stored.assign(longitude=stored.longitude + 0.002),
+        stored.assign(latitude=stored.latitude - 0.002),
+    ]
+    for dfr in shifted:
+        assert len(proc.drop_known(dfr)) == len(dfr)
@@ -0,0 +1,104 @@
+"""
+event_filter_mask rules against the per category merge filters they
+replaced.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("activefire")
+
+from activefire.firedata._utils import spatial_subset_dfr
+from activefire.firedata.prepare import PrepData
+from activefire.firedata.prepare_uk import ProcSQLUK
+
+
+def merge_filter_vegetation(dfr: pd.DataFrame) -> pd.DataFrame:
+    """filter_non_vegetation_events before event_filter_mask, with the
+    unclassified ratio column name fixed"""
+    lc_count = dfr.groupby(["event"])["lc"].value_counts().unstack(fill_value=0)
+    for name, lcs in [
+        ("urban", [13]),
+        ("barren", [15, 16, 17]),
+        ("water", [0]),
+        ("unclass", [255]),
+    ]:
+        if any(x in lc_count for x in lcs):
+            present = [x for x in lcs if x in lc_count]
+            rat = lc_count[present].sum(axis=1) / lc_count.sum(axis=1)
+            rat = rat.reset_index(name=f"{name}_ratio")
+            dfr = dfr.merge(rat, on="event")
+            dfr = dfr[dfr[f"{name}_ratio"] < 0.5]
+            dfr = dfr.drop(f"{name}_ratio", axis=1)
+    return dfr
+
+
+def merge_filter_uk(dfr: pd.DataFrame) -> pd.DataFrame:
+    """ProcSQLUK.clean_nrt before event_filter_mask, with the Fife bbox
+    west edge corrected to -3.33"""
+    lc_count = dfr.groupby(["event"])["lc"].value_counts().unstack(fill_value=0)
+    dfr = dfr[dfr.type != 2]
+    if 20 in lc_count.columns or 21 in lc_count.columns:
+        urban_rat = lc_count.loc[:, 20:].sum(axis=1) / (lc_count.sum(axis=1))
+        urban_rat = urban_rat.reset_index(name="urban_ratio")
+        dfr = dfr.merge(urban_rat, on="event")
+        dfr = dfr[dfr.urban_ratio < 0.5]
+    else:
+        dfr["urban_ratio"] = 0
+    if 0 in lc_count.columns:
+        water_rat = lc_count[0] / (lc_count.sum(axis=1))
+        water_rat = water_rat.reset_index(name="water_ratio")
+        dfr = dfr.merge(water_rat, on="event")
+        dfr = dfr[dfr.water_ratio < 0.5]
+    else:
+        dfr["water_ratio"] = 0
+    fife = spatial_subset_dfr(dfr, [56.11, -3.33, 56.08, -3.28])
+    dfr = dfr[~dfr.isin(fife)].dropna()
+    return dfr
+
+
+def detections(lcs: list, n: int = 3000, seed: int = 0) -> pd.DataFrame:
+    """Small events (two to four detections each, so ratios of exactly
+    0.5 occur) with land cover drawn from lcs, some near Fife"""
+    rng = np.random.default_rng(seed)
+    dfr = pd.DataFrame(
+        {
+            "event": rng.integers(0, n // 3, n) * 5,
+            "type": rng.choice([0, 2, 3], n, p=[0.8, 0.1, 0.1]),
+            "latitude": rng.uniform(56.05, 56.14, n).round(4),
+            "longitude": rng.uniform(-3.36, -3.25, n).round(4),
+            "lc": rng.choice(lcs, n),
+        }
+    )
+    return dfr.sort_values("event", kind="stable").reset_index(drop=True)
+
+
+def assert_same_rows(result: pd.DataFrame, expected: pd.DataFrame):
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(
+        result.reset_index(drop=True),
+        expected[result.columns].reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_vegetation_filter_matches_merges(data_path):
+    dfr = detections([0, 1, 5, 12, 13, 14, 15, 17, 255])
+    result = PrepData("VIIRS_NPP").filter_non_vegetation_events(dfr)
+    assert len(result) < len(dfr)
+    assert_same_rows(result, merge_filter_vegetation(dfr))
+
+
+def test_uk_filter_matches_merges(data_path):
+    dfr = detections([0, 3, 7, 20, 21])
+    result = ProcSQLUK("VIIRS_NPP").clean_nrt(dfr)
+    assert {"urban_ratio", "water_ratio"} <= set(result.columns)
+    assert_same_rows(result, merge_filter_uk(dfr))
+
+
+def test_uk_filter_drops_fife_plant(data_path):
+    dfr = detections([3, 7], n=300)
+    result = ProcSQLUK("VIIRS_NPP").clean_nrt(dfr)
+    assert len(spatial_subset_dfr(dfr, [56.11, -3.33, 56.08, -3.28])) > 0
+    assert len(spatial_subset_dfr(result, [56.11, -3.33, 56.08, -3.28])) == 0
+    assert (result.type != 2).all()
@@ -0,0 +1,75 @@
+"""
+Import time budget: importing populate_db must not import the heavy
+optional dependencies nor read the configuration file, and takes at
+most IMPORT_TIME_FACTOR times a bare pandas import (plus a margin).
+"""
+import sys
+import json
+import subprocess
+import importlib.util
+
+import pytest
+
+HEAVY_MODULES = ["sklearn", "pyhdf", "geopandas", "requests"]
+IMPORT_TIME_FACTOR = 2
+IMPORT_TIME_MARGIN = 0.2
+
+SCRIPT = """
+import sys
+import json
+import activefire.firedata.populate_db
+from activefire import config
+
+print(json.dumps({
+    "modules": sorted(sys.modules),
+    "config_loaded": config.load.cache_info().currsize > 0,
+}))
+"""
+
+TIME_SCRIPT = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+requires_activefire = pytest.mark.skipif(
+    importlib.util.find_spec("activefire") is None,
+    reason="activefire package is not importable",
+)
+
+
+def import_time(module: str, runs: int = 3) -> float:
+    """Shortest of runs import times (s) of module, each in a fresh
+    interpreter"""
+    times = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", TIME_SCRIPT.format(module=module)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return min(times)
+
+
+@requires_activefire
+def test_populate_db_import_is_lazy():
+    # fresh interpreter, modules imported by the test session do not count
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT], capture_output=True, text=True, check=True
+    )
+    state = json.loads(result.stdout.strip().splitlines()[-1])
+    imported = [x for x in HEAVY_MODULES if x in state["modules"]]
+    assert imported == []
+    assert not state["config_loaded"]
+
+
+@requires_activefire
+def test_populate_db_import_time():
+    baseline = import_time("pandas")
+    elapsed = import_time("activefire.firedata.populate_db")
+    assert elapsed <= IMPORT_TIME_FACTOR * baseline + IMPORT_TIME_MARGIN, (
+        f"populate_db import {elapsed:.2f} s, pandas import {baseline:.2f} s"
+    )
@@ -0,0 +1,66 @@
+"""
+Peak RSS of pipeline stages: each stage, nested ones included, reports
+the peak of the process during the stage.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("activefire")
+
+from activefire import config
+from activefire.firedata import metrics
+
+MB = 1024 * 1024
+
+pytestmark = pytest.mark.skipif(
+    not metrics.reset_peak_rss(), reason="peak RSS can not be reset here"
+)
+
+
+def allocate(size_mb: int) -> int:
+    """Touch size_mb of memory and free it, returns the bytes"""
+    block = np.ones(size_mb * MB, dtype=np.uint8)
+    size = int(block.sum())
+    del block
+    return size
+
+
+@pytest.fixture
+def recorder(data_path, monkeypatch):
+    monkeypatch.setitem(config.config_dict["METRICS"], "enabled", True)
+    return metrics.Metrics("VIIRS_NPP")
+
+
+def test_peak_of_each_stage(recorder):
+    with recorder.stage("large"):
+        allocate(200)
+    with recorder.stage("small"):
+        allocate(10)
+    totals = recorder.take()
+    assert totals["large"]["peak_rss_bytes"] - totals["small"]["peak_rss_bytes"] > 150 * MB
+
+
+def test_nested_stages(recorder):
+    with recorder.stage("outer"):
+        allocate(200)
+        with recorder.stage("inner"):
+            allocate(10)
+    with recorder.stage("after"):
+        pass
+    totals = recorder.take()
+    assert totals["outer"]["peak_rss_bytes"] - totals["inner"]["peak_rss_bytes"] > 150 * MB
+    assert totals["outer"]["peak_rss_bytes"] - totals["after"]["peak_rss_bytes"] > 150 * MB
+
+
+def test_peak_over_calls(recorder):
+    for size in [200, 10]:
+        with recorder.stage("repeated"):
+            allocate(size)
+    with recorder.stage("small"):
+        allocate(10)
+    totals = recorder.take()
+    assert totals["repeated"]["calls"] == 2
+    assert totals["repeated"]["peak_rss_bytes"] - totals["small"]["peak_rss_bytes"] > 150 * MB
+    other = metrics.Metrics("VIIRS_NPP")
+    other.merge(totals)
+    assert other.totals["repeated"]["peak_rss_bytes"] == totals["repeated"]["peak_rss_bytes"]
@@ -0,0 +1,93 @@
+"""
+NRTStore fragments: merging fetches, compaction, dropping data
+covered by the archive and reading back from a new store.
+"""
+import pandas as pd
+import pytest
+
+pytest.importorskip("activefire")
+
+from activefire import config
+from activefire.firedata._utils import FireDate
+from activefire.firedata.nrt_store import NRTStore
+from conftest import firms_detections
+
+SENSOR = "VIIRS_NPP"
+
+
+def nrt_dataset(start: str, days: int) -> pd.DataFrame:
+    """Fetched nrt detections as prepared by prepare_nrt_dataset"""
+    dataset = firms_detections(start, days, n_per_day=50)
+    dataset["date"] = FireDate.fire_dates(dataset)
+    dataset = dataset.drop(["acq_date", "acq_time"], axis=1)
+    return dataset.sort_values(by="date").reset_index(drop=True)
+
+
+def sorted_rows(dfr: pd.DataFrame) -> pd.DataFrame:
+    columns = ["date", "longitude", "latitude"]
+    return dfr.sort_values(columns).reset_index(drop=True)
+
+
+@pytest.fixture
+def store(data_path, monkeypatch):
+    monkeypatch.setitem(config.config_dict["DATABASE"], "nrt_compact_min_fragments", 100)
+    return NRTStore(SENSOR)
+
+
+def test_append_merges_overlapping_fetches(store):
+    first = nrt_dataset("2021-06-28", 3)
+    second = nrt_dataset("2021-06-28", 6)
+    assert store.append(first) == len(first)
+    # the first three days are already stored
+    assert store.append(second) == len(second) - len(first)
+    assert store.append(second) == 0
+    assert len(store.fragments()) == 2
+    pd.testing.assert_frame_equal(sorted_rows(store.read()), sorted_rows(second))
+
+
+def test_store_persists(store):
+    dataset = nrt_dataset("2021-06-28", 6)
+    store.append(dataset.iloc[:100])
+    store.append(dataset)
+    reopened = NRTStore(SENSOR)
+    assert reopened.last_date() == dataset.date.max().floor("min")
+    pd.testing.assert_frame_equal(sorted_rows(reopened.read()), sorted_rows(dataset))
+    window = ("2021-06-29", "2021-06-30 23:59")
+    expected = dataset[(dataset.date >= "2021-06-29") & (dataset.date < "2021-07-01")]
+    pd.testing.assert_frame_equal(
+        sorted_rows(reopened.read(window)), sorted_rows(expected)
+    )
+
+
+def test_compact_merges_fragments_of_a_month(store):
+    dataset = nrt_dataset("2021-06-25", 4)
+    for day in dataset.date.dt.day.unique():
+        store.append(dataset[dataset.date.dt.day == day])
+    # spans June and July, left as it is
+    spanning = nrt_dataset("2021-06-29", 3)
+    spanning = spanning[spanning.date >= "2021-06-29 12:00"]
+    store.append(spanning)
+    assert len(store.fragments()) == 5
+    store.compact()
+    fragments = store.fragments()
+    assert len(fragments) == 2
+    assert [x[0].month for x in fragments] == [6, 6]
+    assert [x[1].month for x in fragments] == [6, 7]
+    expected = pd.concat([dataset, spanning]).drop_duplicates(
+        ["date", "longitude", "latitude"]
+    )
+    pd.testing.assert_frame_equal(sorted_rows(store.read()), sorted_rows(expected))
+
+
+def test_drop_in_archive(store):
+    dataset = nrt_dataset("2021-06-28", 6)
+    for day in dataset.date.dt.day.unique():
+        store.append(dataset[dataset.date.dt.day == day])
+    archive_end = pd.Timestamp("2021-06-30 12:00", tz="utc")
+    store.drop_in_archive(archive_end)
+    assert store.fragments()[0][0] > archive_end
+    assert len(store.fragments()) == 4
+    expected = dataset[dataset.date > archive_end]
+    pd.testing.assert_frame_equal(
+        sorted_rows(NRTStore(SENSOR).read()), sorted_rows(expected)
+    )
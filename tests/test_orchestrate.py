@@ -0,0 +1,70 @@
+"""
+run_all exit status and the lookup tables shared by its workers.
+"""
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("activefire")
+
+from activefire import config
+from activefire.firedata import orchestrate, prepare
+
+
+def shared_lookups_run(sensor: str) -> tuple:
+    """run_sensor stand in: fails for BAD, otherwise checks the worker
+    reads the continents table from the shared lookups directory"""
+    if sensor == "BAD":
+        raise RuntimeError("fetch failed")
+    assert prepare._shared_lookups is not None
+    continents_path = Path(config.config_dict["OS"]["admin_data_path"], "missing.parquet")
+    assert list(prepare.continents_table(continents_path).admin) == [250, 826]
+    return sensor, True, 0.0
+
+
+def test_no_sensors(data_path, monkeypatch):
+    monkeypatch.setitem(config.config_dict["TASKS"], "nrt_sensors", [])
+    assert orchestrate.run_all() == 0
+    assert orchestrate.run_all([]) == 0
+    assert not (data_path / "lookups").exists()
+
+
+def test_status_of_failed_sensor(data_path, monkeypatch, caplog):
+    monkeypatch.setattr(orchestrate, "run_sensor", shared_lookups_run)
+    assert orchestrate.run_all(["A", "B"]) == 0
+    with caplog.at_level(logging.ERROR, logger=orchestrate.__name__):
+        assert orchestrate.run_all(["A", "BAD"]) == 1
+    assert "BAD nrt update failed" in caplog.text
+    assert "fetch failed" in caplog.text
+
+
+def test_shared_lookups(data_path, monkeypatch):
+    monkeypatch.setattr(prepare, "_shared_lookups", None)
+    tile = np.arange(16, dtype=np.uint8).reshape(4, 4)
+    reads = []
+
+    def read_hdf4(file_name, dataset=None):
+        reads.append(file_name)
+        return tile
+
+    monkeypatch.setattr(prepare, "read_hdf4", read_hdf4)
+    lookup_dir = orchestrate.shared_lookups_dir()
+    assert Path(lookup_dir) == data_path / "lookups"
+    prepare.share_lookups(lookup_dir)
+    file_name = "MCD12Q1.A2020001.h17v03.006.hdf"
+    assert (prepare.lulc_tile(file_name) == tile).all()
+    # decoded once, later processes memory map the .npy file
+    prepare.clear_caches()
+    shared = prepare.lulc_tile(file_name)
+    assert isinstance(shared, np.memmap)
+    assert (shared == tile).all()
+    assert reads == [file_name]
+    continents = prepare.continents_table(data_path / "missing.parquet")
+    pd.testing.assert_frame_equal(
+        continents,
+        prepare._continents_table(data_path / "countries_continents.parquet"),
+    )
+    prepare.clear_caches()
@@ -0,0 +1,72 @@
+"""
+Year partitions of extinct detections: routing by year, the partitions
+catalogue and finalisation of closed years.
+"""
+import os
+import stat
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("activefire")
+
+from activefire import config
+from activefire.firedata.populate_db import ProcSQL
+from conftest import firms_detections
+
+
+@pytest.fixture
+def proc(data_path, monkeypatch):
+    """Partitioned database loaded with detections from 2020-12-27
+    to 2021-01-05"""
+    monkeypatch.setitem(config.config_dict["DATABASE"], "partition_by_year", True)
+    monkeypatch.setitem(config.config_dict["DATABASE"], "backend", "sqlite")
+    proc = ProcSQL("VIIRS_NPP")
+    for table in ["extinct", "active", "events"]:
+        proc.db.execute_sql(config.config_dict["SQL"][f"sql_create_{table}_table"])
+    dataset = proc.prepare_detections_dataset(firms_detections("2020-12-27", 10))
+    proc.dataframe_to_db(dataset)
+    return proc
+
+
+def extinct_years(proc: ProcSQL) -> pd.Series:
+    extinct = pd.concat(proc.db.extinct_chunks(["id", "date"]))
+    return pd.to_datetime(extinct.date, unit="s").dt.year
+
+
+def test_detections_routed_to_year_partitions(proc):
+    catalogue = proc.db.partitions_catalogue().set_index("year")
+    assert list(catalogue.index) == [2020, 2021]
+    assert proc.db.return_single_value("SELECT count(*) FROM detections_extinct") == 0
+    years = extinct_years(proc)
+    for year in catalogue.index:
+        part = proc.db.partition(year)
+        rows = part.return_single_value("SELECT count(*) FROM detections_extinct")
+        stored = part.return_many_values("SELECT date FROM detections_extinct")
+        assert (pd.to_datetime(stored.date, unit="s").dt.year == year).all()
+        assert rows == (years == year).sum() == catalogue.loc[year, "rows"]
+
+
+def test_repeated_insert_keeps_catalogue_count(proc):
+    rows = proc.db.partitions_catalogue().set_index("year").rows
+    part = proc.db.partition(2021)
+    dataset = part.return_many_values("SELECT * FROM detections_extinct")
+    proc.db.insert_partitioned(dataset)
+    assert proc.db.partitions_catalogue().set_index("year").rows.equals(rows)
+
+
+def test_closed_year_is_finalised(proc):
+    catalogue = proc.db.partitions_catalogue().set_index("year")
+    assert catalogue.loc[2020, "final"] == 1
+    assert catalogue.loc[2021, "final"] == 0
+    part = proc.db.partition(2020)
+    assert part.read_only
+    assert not os.stat(part.db_file).st_mode & stat.S_IWUSR
+    dataset = part.return_many_values("SELECT * FROM detections_extinct")
+    with pytest.raises(ValueError, match="finalised"):
+        proc.db.insert_partitioned(dataset)
+    # finalising again is a no-op
+    proc.db.finalise_closed_partitions(
+        int(pd.Timestamp("2021-01-05", tz="utc").timestamp())
+    )
+    assert proc.db.partition(2020).read_only
@@ -0,0 +1,73 @@
+"""
+Checkpointed nrt runs resume after a load step failed partway.
+"""
+import pandas as pd
+import pytest
+
+pytest.importorskip("activefire")
+
+from activefire import config
+from activefire.firedata.populate_db import ProcSQL
+from conftest import firms_detections
+
+SENSOR = "VIIRS_NPP"
+
+
+def populated_proc(data_path, name: str) -> ProcSQL:
+    """ProcSQL with five days of detections in the database and the
+    following three days returned by fetch_nrt"""
+    config.config_dict["OS"]["data_path"] = str(data_path / name)
+    (data_path / name).mkdir()
+    proc = ProcSQL(SENSOR)
+    for table in ["extinct", "active", "events"]:
+        proc.db.execute_sql(config.config_dict["SQL"][f"sql_create_{table}_table"])
+    dataset = proc.prepare_detections_dataset(firms_detections("2021-06-01", 8))
+    dates = pd.to_datetime(dataset.date, unit="s")
+    proc.dataframe_to_db(dataset[dates < "2021-06-06"].reset_index(drop=True))
+    fetched = dataset[dates >= "2021-06-06"].reset_index(drop=True)
+    proc.fetch_nrt = lambda: fetched.copy()
+    return proc
+
+
+def tables(proc: ProcSQL) -> dict:
+    out = {}
+    for table, key in [
+        ("detections_extinct", "id"),
+        ("detections_active", "id"),
+        ("events", "event"),
+        ("daily_rollup", ["day", "admin", "lc"]),
+    ]:
+        dfr = proc.db.return_many_values(f"SELECT * FROM {table}")
+        out[table] = dfr.sort_values(key).reset_index(drop=True)
+    return out
+
+
+@pytest.mark.parametrize(
+    "owner, failing",
+    [("db", "index_events"), ("db", "insert_keys"), ("proc", "update_rollups")],
+)
+def test_resume_after_partial_load_step(data_path, owner, failing):
+    clean = populated_proc(data_path, "clean")
+    assert clean.run_nrt(checkpoint=True)
+    expected = tables(clean)
+
+    proc = populated_proc(data_path, "failed")
+    target = proc.db if owner == "db" else proc
+    step = getattr(target, failing)
+
+    def fail_after_step(dataset):
+        # the rows are written, the step is not recorded as done
+        step(dataset)
+        raise RuntimeError("killed")
+
+    setattr(target, failing, fail_after_step)
+    with pytest.raises(RuntimeError, match="killed"):
+        proc.run_nrt(checkpoint=True)
+    assert proc.run_journal().stage == "transformed"
+
+    setattr(target, failing, step)
+    assert proc.run_nrt(checkpoint=True)
+    assert proc.run_journal().stage == "loaded"
+    result = tables(proc)
+    for table, dfr in expected.items():
+        pd.testing.assert_frame_equal(result[table], dfr, check_dtype=False)